@@ -0,0 +1,31 @@
+from .holds import (
+    credit_hold_required,
+    credit_holds,
+    insufficient_credits_response,
+)
+from .history import (
+    record_credit_usage,
+    usage_history_buffer,
+)
+from .ledger import (
+    credit_ledger,
+    credit_ledger_enabled,
+    credit_ledger_write,
+)
+from .status import (
+    get_credit_status,
+    invalidate_credit_status,
+)
+
+__all__ = [
+    'credit_hold_required',
+    'credit_holds',
+    'credit_ledger',
+    'credit_ledger_enabled',
+    'credit_ledger_write',
+    'get_credit_status',
+    'insufficient_credits_response',
+    'invalidate_credit_status',
+    'record_credit_usage',
+    'usage_history_buffer',
+]
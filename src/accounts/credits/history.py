@@ -0,0 +1,172 @@
+"""
+Per-worker buffer for ``CreditUsageHistory`` rows.
+
+``CREDIT_HISTORY_MODE = "immediate"`` (the default) inserts one row per
+``use_credit`` call, as before. ``"buffered"`` collects the rows in memory
+and writes them with ``bulk_create`` once ``CREDIT_HISTORY_BUFFER_SIZE``
+rows are pending or the oldest has waited ``CREDIT_HISTORY_FLUSH_INTERVAL``
+seconds, and again when the worker exits. Rows keep the time of the debit
+(``date`` is set when the row is built), so only their insert is delayed.
+A row is queued once the transaction that made the debit commits, and
+dropped if it rolls back. Either way rows go through
+``save_credit_usage``, which also folds them into the ``DailyCreditUsage``
+rollups in the same transaction.
+
+Trade-offs, all settings:
+
+- ``CREDIT_HISTORY_BUFFER_SIZE`` / ``CREDIT_HISTORY_FLUSH_INTERVAL`` bound
+  how many rows a hard-killed worker can lose and how stale the history
+  endpoint can be.
+- ``CREDIT_HISTORY_ORDERED``: when True, batches are written one at a time
+  in the order they were filled, so ids follow debit order. When False,
+  a request thread that fills the buffer writes its batch right away even
+  if another batch is still being written.
+- ``CREDIT_HISTORY_MAX_PENDING``: rows from failed flushes are kept and
+  retried up to this many; beyond it the oldest are dropped and logged.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger('goldmage')
+
+
+def history_buffering_enabled():
+    return getattr(settings, 'CREDIT_HISTORY_MODE', 'immediate') == 'buffered'
+
+
+class UsageHistoryBuffer:
+    def __init__(self, size=None, interval=None, ordered=None, max_pending=None):
+        self.size = size or getattr(settings, 'CREDIT_HISTORY_BUFFER_SIZE', 100)
+        self.interval = interval or getattr(settings, 'CREDIT_HISTORY_FLUSH_INTERVAL', 5.0)
+        self.ordered = ordered if ordered is not None else getattr(settings, 'CREDIT_HISTORY_ORDERED', True)
+        self.max_pending = max_pending or getattr(settings, 'CREDIT_HISTORY_MAX_PENDING', 10000)
+        self._rows = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, row):
+        """Queue an unsaved ``CreditUsageHistory`` instance."""
+        self._ensure_flusher()
+        with self._lock:
+            self._rows.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._rows) >= self.size
+        if full:
+            if self.ordered or connection.in_atomic_block:
+                # Let the flusher thread write it so batches stay in order, and so
+                # other requests' rows never join the caller's transaction
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    def _take(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._oldest = None
+        return rows
+
+    def _requeue(self, rows):
+        with self._lock:
+            self._rows[:0] = rows
+            dropped = len(self._rows) - self.max_pending
+            if dropped > 0:
+                del self._rows[:dropped]
+                logger.error(f"Dropped {dropped} credit usage history rows after repeated flush failures")
+            if self._rows and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def flush(self):
+        """Write every pending row; returns how many were inserted."""
+        if self.ordered:
+            self._flush_lock.acquire()
+        try:
+            rows = self._take()
+            if not rows:
+                return 0
+            try:
+                save_credit_usage(rows, batch_size=self.size)
+            except Exception as e:
+                logger.warning(f"Credit usage history flush of {len(rows)} rows failed, will retry: {e}")
+                self._requeue(rows)
+                return 0
+            return len(rows)
+        finally:
+            if self.ordered:
+                self._flush_lock.release()
+
+    def _due(self):
+        with self._lock:
+            if not self._rows:
+                return False
+            return len(self._rows) >= self.size or time.monotonic() - self._oldest >= self.interval
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self._due():
+                continue
+            try:
+                self.flush()
+            finally:
+                # This thread owns its own connection; don't keep it open between flushes
+                connection.close()
+
+    def _ensure_flusher(self):
+        # Started lazily and per process: gunicorn forks workers after import
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None:
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='credit-history-flusher', daemon=True)
+            self._thread.start()
+
+
+def save_credit_usage(rows, batch_size=None):
+    """Insert CreditUsageHistory rows and add them to the daily rollups in one transaction."""
+    from accounts.models import CreditUsageHistory, DailyCreditUsage
+
+    with transaction.atomic():
+        if len(rows) == 1:
+            rows[0].save(force_insert=True)
+        else:
+            CreditUsageHistory.objects.bulk_create(rows, batch_size=batch_size)
+        DailyCreditUsage.objects.add_usage(rows)
+    return len(rows)
+
+
+usage_history_buffer = UsageHistoryBuffer()
+
+
+def record_credit_usage(row):
+    """Insert a usage row now or queue it, depending on ``CREDIT_HISTORY_MODE``."""
+    if history_buffering_enabled():
+        # Queued only once the debit commits, so a rolled-back debit leaves no history
+        transaction.on_commit(lambda: usage_history_buffer.add(row))
+    else:
+        save_credit_usage([row])
+
+
+@atexit.register
+def _flush_on_exit():
+    if usage_history_buffer.pending():
+        flushed = usage_history_buffer.flush()
+        logger.info(f"Flushed {flushed} credit usage history rows on shutdown")
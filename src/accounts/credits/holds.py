@@ -0,0 +1,239 @@
+"""
+Short-lived credit holds for requests that debit after a slow AI call.
+
+``credit_holds.reserve(user)`` atomically checks the user's effective
+balance minus their open holds and records a hold in Redis, so parallel
+requests cannot all pass the credit check with one credit left. The view
+then calls ``hold.commit(...)`` (the normal ``use_credit`` debit, then the
+hold is dropped) or ``hold.release()``. Holds live in a per-user sorted set
+scored by expiry, never on the user row; a hold whose request died is
+ignored once it expires and reclaimed by ``manage.py sweep_credit_holds``.
+The balance is re-read from the database (or ledger) when reserving, not
+taken from the user loaded at authentication. ``commit`` still returns
+False if the debit finds no credit left, and callers must then answer
+402 instead of returning the paid result.
+
+When Redis can't be reached, ``reserve`` falls back to the plain balance
+check and returns a hold that isn't stored, so the AI endpoints keep
+working on the database alone. After a failure, Redis is skipped for
+``CREDIT_HOLD_RETRY_AFTER`` seconds so requests don't each wait out the
+connection timeout.
+"""
+import logging
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+from rest_framework.response import Response
+
+from .ledger import LEDGER_FIELDS
+
+logger = logging.getLogger('goldmage')
+
+HOLDS_KEY_PREFIX = 'credits:holds:'
+HOLDS_INDEX_KEY = 'credits:holds'
+
+# Redis down or unreachable, or the cache isn't django_redis at all
+STORE_ERRORS = (RedisError, OSError, NotImplementedError)
+
+# KEYS: holds zset (id -> expiry), amounts hash (id -> amount), index zset (pk -> expiry)
+# ARGV: now, expires_at, hold id, amount, available credits, pk, key ttl
+RESERVE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+  redis.call('HDEL', KEYS[2], unpack(expired))
+end
+local held = 0
+for _, amount in ipairs(redis.call('HVALS', KEYS[2])) do
+  held = held + tonumber(amount)
+end
+if held + tonumber(ARGV[4]) > tonumber(ARGV[5]) then
+  return {0, held}
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[4])
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[7]) then
+  redis.call('EXPIRE', KEYS[1], ARGV[7])
+  redis.call('EXPIRE', KEYS[2], ARGV[7])
+end
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[6])
+return {1, held + tonumber(ARGV[4])}
+"""
+
+RELEASE_SCRIPT = """
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return removed
+"""
+
+# Drop a user's expired holds and re-score (or remove) them in the index
+SWEEP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+  redis.call('HDEL', KEYS[2], unpack(expired))
+end
+local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if #last == 0 then
+  redis.call('ZREM', KEYS[3], ARGV[2])
+else
+  redis.call('ZADD', KEYS[3], last[2], ARGV[2])
+end
+return #expired
+"""
+
+
+def _keys(pk):
+    return [f'{HOLDS_KEY_PREFIX}{pk}', f'{HOLDS_KEY_PREFIX}{pk}:amounts', HOLDS_INDEX_KEY]
+
+
+class CreditHold:
+    def __init__(self, store, user, hold_id, amount, expires_at):
+        self.store = store
+        self.user = user
+        self.id = hold_id
+        self.amount = amount
+        self.expires_at = expires_at
+        self.settled = False
+
+    def commit(self, event_type="Message", cost=1, kind="Monthly Credits", model_name=None):
+        """Debit the reserved credit through ``use_credit`` and drop the hold."""
+        success = self.user.use_credit(event_type=event_type, cost=cost, kind=kind, model_name=model_name)
+        if not success:
+            logger.warning(f"Credit hold {self.id} committed but user {self.user.pk} had no credits left")
+        # Only once the debit is committed, so the credit is never counted as free in between
+        transaction.on_commit(self.release)
+        return success
+
+    def release(self):
+        if self.settled:
+            return False
+        self.settled = True
+        if self.store is None:
+            return False
+        return self.store.release(self)
+
+
+class CreditHoldStore:
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._client = None
+        self._scripts = {}
+        self._skip_until = 0.0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from django_redis import get_redis_connection
+            self._client = get_redis_connection(self.alias)
+        return self._client
+
+    def script(self, name, source):
+        if name not in self._scripts:
+            self._scripts[name] = self.client.register_script(source)
+        return self._scripts[name]
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CREDIT_HOLD_TTL', 120)
+
+    def _unavailable(self, error):
+        retry_after = getattr(settings, 'CREDIT_HOLD_RETRY_AFTER', 30)
+        self._skip_until = time.monotonic() + retry_after
+        logger.warning(
+            f"Credit holds unavailable, falling back to the balance check for {retry_after}s: {error}"
+        )
+
+    def reserve(self, user, amount=1, ttl=None):
+        """Return a CreditHold, or None when the balance minus open holds can't cover ``amount``."""
+        # ``user`` was loaded at authentication; a debit may have committed since
+        user.refresh_from_db(fields=[*LEDGER_FIELDS, 'membership'])
+        available = user.get_remaining_credits()
+        if available < amount:
+            return None
+        ttl = ttl or self.ttl
+        now = time.time()
+        hold_id = uuid.uuid4().hex
+        if time.monotonic() < self._skip_until:
+            return CreditHold(None, user, hold_id, amount, now + ttl)
+        try:
+            reserved, _ = self.script('reserve', RESERVE_SCRIPT)(
+                keys=_keys(user.pk),
+                args=[now, now + ttl, hold_id, amount, available, user.pk, int(ttl) + 1],
+            )
+        except STORE_ERRORS as e:
+            # The balance check above still applies; only parallel requests go unguarded
+            self._unavailable(e)
+            return CreditHold(None, user, hold_id, amount, now + ttl)
+        if not reserved:
+            return None
+        return CreditHold(self, user, hold_id, amount, now + ttl)
+
+    def release(self, hold):
+        try:
+            return bool(self.script('release', RELEASE_SCRIPT)(keys=_keys(hold.user.pk), args=[hold.id]))
+        except STORE_ERRORS as e:
+            # The hold expires on its own after CREDIT_HOLD_TTL
+            self._unavailable(e)
+            return False
+
+    def held(self, pk):
+        """Credits currently reserved by a user's unexpired holds."""
+        keys = _keys(pk)
+        live = self.client.zrangebyscore(keys[0], time.time(), '+inf')
+        if not live:
+            return 0
+        return sum(int(amount) for amount in self.client.hmget(keys[1], live) if amount is not None)
+
+    def sweep(self, batch_size=500):
+        """Reclaim expired holds; returns ``(users_checked, holds_reclaimed)``."""
+        now = time.time()
+        sweep = self.script('sweep', SWEEP_SCRIPT)
+        users = reclaimed = 0
+        while True:
+            pks = self.client.zrangebyscore(HOLDS_INDEX_KEY, '-inf', now, start=0, num=batch_size)
+            if not pks:
+                return users, reclaimed
+            for pk in pks:
+                pk = pk.decode() if isinstance(pk, bytes) else pk
+                reclaimed += sweep(keys=_keys(pk), args=[now, pk])
+            users += len(pks)
+
+
+credit_holds = CreditHoldStore()
+
+
+def insufficient_credits_response(user):
+    return Response({
+        'error': 'Insufficient credits',
+        'remaining_credits': user.credits,
+        'next_refill': user.get_daily_refill_time(),
+        'is_thread_locked': user.is_thread_depth_locked,
+    }, status=402)
+
+
+def credit_hold_required(view):
+    """
+    Reserve one credit for the duration of a viewset action.
+
+    Responds 402 when the user can't cover it; otherwise the hold is
+    available as ``request.credit_hold`` for the view to commit (answering
+    ``insufficient_credits_response`` if that returns False), and is
+    released when the view returns without committing (errors, early
+    returns, raised exceptions).
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        hold = credit_holds.reserve(request.user)
+        if hold is None:
+            return insufficient_credits_response(request.user)
+        request.credit_hold = hold
+        try:
+            return view(self, request, *args, **kwargs)
+        finally:
+            hold.release()
+    return wrapper
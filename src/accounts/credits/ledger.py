@@ -0,0 +1,561 @@
+"""
+Optional Redis credit engine (``CREDIT_ENGINE = "redis"``).
+
+Balances, the 14-day usage buckets and the lock flag for active users
+live in Redis hashes per user and are debited by an atomic Lua script,
+so hot users never contend on their ``accounts_customuser`` row. Changed
+users are tracked in a dirty set and spent credits are queued as
+``CreditUsageHistory`` events; ``flush_credit_ledger`` writes both back
+to the database in batches and ``reconcile_credit_ledger`` detects and
+repairs drift between the two stores.
+
+While a user's hash exists it is authoritative for the credit columns.
+Code that changes those columns through the ORM (purchases, webhooks)
+must do so inside ``credit_ledger_write(user)``. It marks the user as
+being written, so debits go to the database row until the block commits,
+then flushes the user's pending state and evicts the hash.
+
+A flush claims dirty users in a processing set and only releases them
+(and lets their hash start to expire) once the database write commits.
+Claims a dead flusher left behind for ``CREDIT_LEDGER_CLAIM_TIMEOUT``
+seconds go back to the dirty set, so no debit is dropped from Redis
+before it reaches the database.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger('goldmage')
+
+KEY_PREFIX = 'credits'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+PROCESSING_KEY = f'{KEY_PREFIX}:dirty:processing'
+WRITING_KEY_PREFIX = f'{KEY_PREFIX}:writing:'
+USAGE_KEY_PREFIX = f'{KEY_PREFIX}:usage:'
+EVENTS_KEY = f'{KEY_PREFIX}:events'
+
+EPOCH_DAY = date(1970, 1, 1)
+
+# Upper bound on a credit_ledger_write() block; the marker is normally
+# deleted when the block's transaction commits
+WRITING_TTL = 60
+
+# Database fields mirrored in the per-user hash
+LEDGER_FIELDS = [
+    'credits',
+    'last_depleted_time',
+    'total_usage_14d',
+    'last_usage_timestamp',
+    'is_thread_depth_locked',
+]
+
+# Same policy as CustomUser.use_credit(), on epoch-second timestamps.
+# Timestamps are stored as the strings we were given so Lua's number
+# formatting never rounds them. The 14-day window is a second hash of
+# day number -> uses (KEYS[4]), mirroring UsageBucket.
+DEBIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[5]) == 1 then
+  return {-2}
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return {-1}
+end
+local state = redis.call('HMGET', KEYS[1], 'credits', 'last_depleted', 'usage', 'last_usage', 'locked', 'premium')
+local credits = tonumber(state[1])
+local last_depleted = state[2]
+local usage = tonumber(state[3])
+local last_usage = state[4]
+local locked = state[5] == '1'
+local premium = state[6] == '1'
+
+if credits == 0 and last_depleted ~= '' then
+  local refill_before = tonumber(ARGV[2])
+  if locked then refill_before = tonumber(ARGV[3]) end
+  if tonumber(last_depleted) <= refill_before then
+    credits = tonumber(ARGV[6])
+    last_depleted = ''
+    if locked then
+      locked = false
+      usage = 0
+    end
+  end
+end
+if credits <= 0 then
+  return {0, credits}
+end
+
+credits = credits - 1
+if credits == 0 then last_depleted = ARGV[1] end
+if premium then
+  locked = false
+else
+  local first_day = tonumber(ARGV[4])
+  if redis.call('HINCRBY', KEYS[4], ARGV[5], 1) == 1 then
+    -- First use today: expire days that left the window
+    for _, day in ipairs(redis.call('HKEYS', KEYS[4])) do
+      if tonumber(day) < first_day then redis.call('HDEL', KEYS[4], day) end
+    end
+  end
+  redis.call('EXPIRE', KEYS[4], ARGV[10])
+  local window = 0
+  for _, count in ipairs(redis.call('HVALS', KEYS[4])) do
+    window = window + tonumber(count)
+  end
+  last_usage = ARGV[1]
+  if window >= tonumber(ARGV[7]) then
+    locked = true
+    usage = 0
+    redis.call('DEL', KEYS[4])
+  end
+end
+
+redis.call('HSET', KEYS[1], 'credits', credits, 'last_depleted', last_depleted,
+  'usage', usage, 'last_usage', last_usage, 'locked', locked and 1 or 0)
+redis.call('PERSIST', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[8])
+redis.call('RPUSH', KEYS[3], ARGV[9])
+return {1, credits}
+"""
+
+# Load a user's state (ARGV[3..2+ARGV[1]]) and usage buckets (the rest) from
+# the database unless another request beat us to it
+HYDRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+  return -1
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return 0
+end
+local fields = tonumber(ARGV[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3, 2 + fields))
+redis.call('DEL', KEYS[2])
+if #ARGV > 2 + fields then
+  redis.call('HSET', KEYS[2], unpack(ARGV, 3 + fields))
+  redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# Atomically move up to ARGV[1] dirty users to the processing zset (KEYS[2],
+# scored by claim time ARGV[4]) and snapshot their hashes and usage buckets.
+# Claims older than ARGV[5] were left by a flusher that died; requeue them first.
+# Users with a write marker (prefix ARGV[6]) are left in the dirty set.
+SNAPSHOT_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[5])
+if #stale > 0 then
+  redis.call('SADD', KEYS[1], unpack(stale))
+  redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[5])
+end
+local ids = redis.call('SPOP', KEYS[1], ARGV[1])
+local result = {}
+for _, id in ipairs(ids) do
+  if redis.call('EXISTS', ARGV[6] .. id) == 1 then
+    -- Inside credit_ledger_write(), which flushes the user itself
+    redis.call('SADD', KEYS[1], id)
+  else
+    redis.call('ZADD', KEYS[2], ARGV[4], id)
+    table.insert(result, id)
+  table.insert(result, redis.call('HGETALL', ARGV[2] .. id))
+    table.insert(result, redis.call('HGETALL', ARGV[3] .. id))
+  end
+end
+return result
+"""
+
+# Release claims (ARGV[3..]) once their rows are committed. Flushed hashes get
+# a TTL (ARGV[2]) so idle users age out of Redis, unless a debit dirtied them
+# again meanwhile (the debit script PERSISTs the hash anyway).
+RELEASE_SCRIPT = """
+for i = 3, #ARGV do
+  local id = ARGV[i]
+  redis.call('ZREM', KEYS[2], id)
+  if redis.call('SISMEMBER', KEYS[1], id) == 0 then
+    redis.call('EXPIRE', ARGV[1] .. id, ARGV[2])
+  end
+end
+return #ARGV - 2
+"""
+
+# Put claims (ARGV) back in the dirty set after a failed write
+REQUEUE_SCRIPT = """
+redis.call('SADD', KEYS[1], unpack(ARGV))
+redis.call('ZREM', KEYS[2], unpack(ARGV))
+return #ARGV
+"""
+
+# Delete a user's hash and buckets (and dirty flag, id ARGV[1]) only if the
+# hash still matches the snapshot that was flushed (ARGV[2..], field/value pairs)
+EVICT_IF_UNCHANGED_SCRIPT = """
+local current = redis.call('HGETALL', KEYS[1])
+if #current ~= #ARGV - 1 then
+  return 0
+end
+local expected = {}
+for i = 2, #ARGV, 2 do
+  expected[ARGV[i]] = ARGV[i + 1]
+end
+for i = 1, #current, 2 do
+  if expected[current[i]] ~= current[i + 1] then
+    return 0
+  end
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('SREM', KEYS[3], ARGV[1])
+return 1
+"""
+
+
+def credit_ledger_enabled():
+    return getattr(settings, 'CREDIT_ENGINE', 'db') == 'redis'
+
+
+def user_key(pk):
+    return f'{KEY_PREFIX}:user:{pk}'
+
+
+def usage_key(pk):
+    return f'{USAGE_KEY_PREFIX}{pk}'
+
+
+def writing_key(pk):
+    return f'{WRITING_KEY_PREFIX}{pk}'
+
+
+def _day_number(day):
+    return (day - EPOCH_DAY).days
+
+
+def _decode_buckets(raw):
+    """Usage hash reply -> ``{date: count}``."""
+    if isinstance(raw, list):
+        raw = dict(zip(raw[::2], raw[1::2]))
+    return {EPOCH_DAY + timedelta(days=int(day)): int(count) for day, count in raw.items()}
+
+
+def _epoch(value):
+    if value is None:
+        return ''
+    return f'{int(value.replace(microsecond=0).timestamp())}.{value.microsecond:06d}'
+
+
+def _from_epoch(value):
+    if isinstance(value, bytes):
+        value = value.decode()
+    if not value:
+        return None
+    # Parse seconds and microseconds separately; a float would round the latter
+    seconds, _, fraction = value.partition('.')
+    return datetime.fromtimestamp(int(seconds), tz=dt_timezone.utc) + timedelta(
+        microseconds=int(fraction.ljust(6, '0')[:6] or 0)
+    )
+
+
+def _decode_hash(raw):
+    """HGETALL reply (flat list or dict, bytes) -> the model's field values."""
+    if isinstance(raw, list):
+        raw = dict(zip(raw[::2], raw[1::2]))
+    data = {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in raw.items()
+    }
+    return {
+        'credits': int(data['credits']),
+        'last_depleted_time': _from_epoch(data.get('last_depleted')),
+        'total_usage_14d': int(data.get('usage') or 0),
+        'last_usage_timestamp': _from_epoch(data.get('last_usage')),
+        'is_thread_depth_locked': data.get('locked') == '1',
+    }
+
+
+class RedisCreditLedger:
+    def __init__(self, alias='default', flushed_ttl=60 * 60 * 24):
+        self.alias = alias
+        self.flushed_ttl = flushed_ttl
+        self._client = None
+        self._scripts = {}
+
+    @property
+    def claim_timeout(self):
+        return getattr(settings, 'CREDIT_LEDGER_CLAIM_TIMEOUT', 300)
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Reuse the connection pool django_redis already manages for CACHES
+            from django_redis import get_redis_connection
+            self._client = get_redis_connection(self.alias)
+        return self._client
+
+    def script(self, name, source):
+        if name not in self._scripts:
+            self._scripts[name] = self.client.register_script(source)
+        return self._scripts[name]
+
+    def hydrate(self, user):
+        from accounts.models import USAGE_WINDOW, CustomUser, UsageBucket
+
+        row = CustomUser.objects.filter(pk=user.pk).values(*LEDGER_FIELDS, 'membership').first()
+        if row is None:
+            return False
+        fields = [
+            'credits', row['credits'],
+            'last_depleted', _epoch(row['last_depleted_time']),
+            'usage', row['total_usage_14d'],
+            'last_usage', _epoch(row['last_usage_timestamp']),
+            'locked', int(row['is_thread_depth_locked']),
+            'premium', int(row['membership'] == 'PREMIUM'),
+        ]
+        buckets = []
+        window_start = UsageBucket.objects.window_start(timezone.localdate())
+        for day, count in UsageBucket.objects.filter(user_id=user.pk, day__gte=window_start).values_list('day', 'count'):
+            buckets += [_day_number(day), count]
+        # Refused while credit_ledger_write() runs: the row may be about to change
+        self.script('hydrate', HYDRATE_SCRIPT)(
+            keys=[user_key(user.pk), usage_key(user.pk), writing_key(user.pk)],
+            args=[len(fields), int(USAGE_WINDOW.total_seconds()), *fields, *buckets],
+        )
+        return True
+
+    def debit(self, user, event_type, cost, kind, model_name, now=None):
+        """
+        Spend one credit in Redis; returns ``(success, remaining_credits)``, or
+        None while the user is inside ``credit_ledger_write()`` and the caller
+        must debit the database row instead.
+        """
+        from accounts.models import (
+            CREDIT_REFILL_AMOUNT,
+            CREDIT_REFILL_DELAY,
+            LOCKED_CREDIT_REFILL_DELAY,
+            THREAD_DEPTH_LIMIT,
+            USAGE_WINDOW,
+            UsageBucket,
+        )
+
+        now = now or timezone.now()
+        event = json.dumps({
+            'user_id': user.pk,
+            'event_type': event_type,
+            'cost': str(cost),
+            'kind': kind,
+            'model': model_name,
+            'date': now.isoformat(),
+        })
+        today = timezone.localdate(now)
+        args = [
+            _epoch(now),
+            _epoch(now - CREDIT_REFILL_DELAY),
+            _epoch(now - LOCKED_CREDIT_REFILL_DELAY),
+            _day_number(UsageBucket.objects.window_start(today)),
+            _day_number(today),
+            CREDIT_REFILL_AMOUNT,
+            THREAD_DEPTH_LIMIT,
+            user.pk,
+            event,
+            int(USAGE_WINDOW.total_seconds()),
+        ]
+        keys = [user_key(user.pk), DIRTY_KEY, EVENTS_KEY, usage_key(user.pk), writing_key(user.pk)]
+        debit = self.script('debit', DEBIT_SCRIPT)
+        result = debit(keys=keys, args=args)
+        if result[0] == -1:
+            if not self.hydrate(user):
+                return False, 0
+            result = debit(keys=keys, args=args)
+        if result[0] < 0:
+            return None
+        return result[0] == 1, int(result[1])
+
+    def state(self, pk):
+        """Current ledger values for a user, or None when the user is not in Redis."""
+        raw = self.client.hgetall(user_key(pk))
+        return _decode_hash(raw) if raw else None
+
+    def usage_in_window(self, pk, now=None):
+        """Uses in the 14-day window from the user's Redis buckets, or None when not in Redis."""
+        from accounts.models import UsageBucket
+
+        if not self.client.exists(user_key(pk)):
+            return None
+        window_start = UsageBucket.objects.window_start(timezone.localdate(now or timezone.now()))
+        buckets = _decode_buckets(self.client.hgetall(usage_key(pk)))
+        return sum(count for day, count in buckets.items() if day >= window_start)
+
+    def flush(self, batch_size=500):
+        """
+        Write dirty balances and queued usage events to the database.
+        Returns ``(users_flushed, events_flushed)``.
+        """
+        from accounts.models import CustomUser, UsageBucket
+
+        now = time.time()
+        reply = self.script('snapshot', SNAPSHOT_SCRIPT)(
+            keys=[DIRTY_KEY, PROCESSING_KEY],
+            args=[
+                batch_size, f'{KEY_PREFIX}:user:', USAGE_KEY_PREFIX,
+                now, now - self.claim_timeout, WRITING_KEY_PREFIX,
+            ],
+        )
+        claimed = [int(pk) for pk in reply[::3]]
+        users = []
+        buckets = []
+        for pk, raw, raw_buckets in zip(reply[::3], reply[1::3], reply[2::3]):
+            if raw:
+                users.append(CustomUser(pk=int(pk), **_decode_hash(raw)))
+                buckets += [
+                    UsageBucket(user_id=int(pk), day=day, count=count)
+                    for day, count in _decode_buckets(raw_buckets).items()
+                ]
+        try:
+            with transaction.atomic():
+                CustomUser.objects.bulk_update(users, LEDGER_FIELDS, batch_size=batch_size)
+                # Redis holds the whole window for these users; replace their buckets
+                UsageBucket.objects.filter(user_id__in=[user.pk for user in users]).delete()
+                UsageBucket.objects.bulk_create(buckets, batch_size=batch_size)
+        except Exception:
+            # Put them back so the next flush retries
+            if claimed:
+                self.script('requeue', REQUEUE_SCRIPT)(keys=[DIRTY_KEY, PROCESSING_KEY], args=claimed)
+            raise
+        if claimed:
+            # Committed: drop the claims and let idle hashes start to expire
+            self.script('release', RELEASE_SCRIPT)(
+                keys=[DIRTY_KEY, PROCESSING_KEY],
+                args=[f'{KEY_PREFIX}:user:', self.flushed_ttl, *claimed],
+            )
+        return len(users), self.flush_events(batch_size)
+
+    def flush_events(self, batch_size=500):
+        from accounts.models import CreditUsageHistory
+        from .history import save_credit_usage
+
+        raw_events = self.client.lrange(EVENTS_KEY, 0, batch_size - 1)
+        if not raw_events:
+            return 0
+        rows = []
+        for raw in raw_events:
+            event = json.loads(raw)
+            rows.append(CreditUsageHistory(
+                user_id=event['user_id'],
+                event_type=event['event_type'],
+                cost=Decimal(event['cost']),
+                kind=event['kind'],
+                model=event['model'],
+                date=datetime.fromisoformat(event['date']),
+            ))
+        save_credit_usage(rows, batch_size=batch_size)
+        # Trim only after the rows are committed: at-least-once delivery
+        self.client.ltrim(EVENTS_KEY, len(raw_events), -1)
+        return len(rows)
+
+    def flush_user(self, pk):
+        """
+        Persist one user's ledger state right away (used before ORM writes).
+        Returns the raw hash that was written, or None when the user is not in Redis.
+        """
+        from accounts.models import CustomUser, UsageBucket
+
+        raw = self.client.hgetall(user_key(pk))
+        if not raw:
+            return None
+        state = _decode_hash(raw)
+        buckets = _decode_buckets(self.client.hgetall(usage_key(pk)))
+        with transaction.atomic():
+            CustomUser.objects.filter(pk=pk).update(**state)
+            UsageBucket.objects.filter(user_id=pk).delete()
+            UsageBucket.objects.bulk_create([
+                UsageBucket(user_id=pk, day=day, count=count) for day, count in buckets.items()
+            ])
+        return raw
+
+    def evict(self, pk):
+        self.client.delete(user_key(pk), usage_key(pk))
+        self.client.srem(DIRTY_KEY, pk)
+
+    def evict_if_unchanged(self, pk, raw):
+        """Evict the user only if their hash is still ``raw``; returns whether it was evicted."""
+        pairs = []
+        for field, value in raw.items():
+            pairs += [field, value]
+        return bool(self.script('evict', EVICT_IF_UNCHANGED_SCRIPT)(
+            keys=[user_key(pk), usage_key(pk), DIRTY_KEY],
+            args=[pk, *pairs],
+        ))
+
+    def wait_for_claim(self, pk, timeout=5.0):
+        """Wait for a running flush that has claimed this user to finish."""
+        deadline = time.monotonic() + timeout
+        while self.client.zscore(PROCESSING_KEY, pk) is not None:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Credit ledger flush still holds user {pk} after {timeout}s")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def start_write(self, pk):
+        self.client.set(writing_key(pk), 1, ex=WRITING_TTL)
+
+    def end_write(self, pk):
+        self.client.delete(writing_key(pk))
+
+    def iter_user_states(self, count=500):
+        prefix = f'{KEY_PREFIX}:user:'
+        for key in self.client.scan_iter(match=f'{prefix}*', count=count):
+            key = key.decode() if isinstance(key, bytes) else key
+            raw = self.client.hgetall(key)
+            if raw:
+                yield int(key[len(prefix):]), _decode_hash(raw)
+
+    def cached_users(self, pks):
+        """The subset of ``pks`` whose state currently lives in Redis."""
+        pipe = self.client.pipeline(transaction=False)
+        for pk in pks:
+            pipe.exists(user_key(pk))
+        return {pk for pk, exists in zip(pks, pipe.execute()) if exists}
+
+    def dirty_users(self):
+        """Users waiting for the flusher, including those a flush has claimed."""
+        pending = self.client.smembers(DIRTY_KEY) | set(self.client.zrange(PROCESSING_KEY, 0, -1))
+        return {int(pk) for pk in pending}
+
+
+credit_ledger = RedisCreditLedger()
+
+
+@contextmanager
+def credit_ledger_write(user):
+    """
+    Wrap ORM changes to a user's credit columns. With the Redis engine on,
+    the user is marked as being written, so debits go to the database row
+    and nothing reloads the hash until the block commits. Pending ledger
+    state is then written to the row (and reloaded onto ``user``) and the
+    hash evicted, all before the block runs, so the next debit after it
+    starts from what the block saved. Either way the cached credit status
+    is invalidated.
+    """
+    from .status import invalidate_credit_status
+
+    if not credit_ledger_enabled() or user.pk is None:
+        yield user
+        invalidate_credit_status(user.pk)
+        return
+    pk = user.pk
+    credit_ledger.start_write(pk)
+    try:
+        credit_ledger.wait_for_claim(pk)
+        while True:
+            raw = credit_ledger.flush_user(pk)
+            # A debit that got in before the marker changes the hash; flush again
+            if raw is None or credit_ledger.evict_if_unchanged(pk, raw):
+                break
+        user.refresh_from_db(fields=LEDGER_FIELDS)
+        yield user
+    finally:
+        # On rollback the callback is dropped and the marker expires after WRITING_TTL
+        transaction.on_commit(lambda: credit_ledger.end_write(pk))
+    invalidate_credit_status(pk)
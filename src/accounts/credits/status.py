@@ -0,0 +1,131 @@
+"""
+Per-user cache of the ``credits/status/`` payload.
+
+Each entry carries the user's status version and an ETag. Writers of the
+credit columns (debits, purchases and webhooks via ``credit_ledger_write``,
+refills) call ``invalidate_credit_status``, which bumps the version once
+their transaction commits. On a miss the version is read first and the
+credit columns are reloaded after it, so a payload built from data read
+before a bump is stored under the old version and ignored: a poll racing
+a debit can't pin a stale balance. A poll that hits the cache costs one
+``get_many``.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .ledger import LEDGER_FIELDS
+
+logger = logging.getLogger('goldmage')
+
+STATUS_KEY_PREFIX = 'credit_status'
+
+# Everything build_credit_status() reads from the user row
+STATUS_FIELDS = [*LEDGER_FIELDS, 'membership']
+
+
+def _status_key(pk):
+    return f'{STATUS_KEY_PREFIX}:{pk}'
+
+
+def _version_key(pk):
+    return f'{STATUS_KEY_PREFIX}:{pk}:version'
+
+
+def build_credit_status(user, now=None):
+    """The status payload, with a due refill counted but not written."""
+    now = now or timezone.now()
+    user.get_remaining_credits()
+
+    reset_time = user.get_daily_refill_time()
+    reset_time_iso = reset_time.isoformat() if reset_time else None
+
+    days_until_refill = (reset_time - now).days if reset_time else None
+
+    is_free_user = user.membership == 'FREE'
+    usage_14d = user.usage_in_window(now) if is_free_user else 0
+
+    return {
+        'remaining_credits': user.credits,
+        'reset_time': reset_time_iso,
+        'is_out_of_credits': user.credits <= 0,
+        'plan_type': user.membership,
+        'total_credits': 200 if user.membership == 'PREMIUM' else 10,
+        'total_usage_14d': usage_14d,
+        'is_thread_locked': user.is_thread_depth_locked if is_free_user else False,
+        'days_until_refill': days_until_refill,
+        'needs_extended_refresh': is_free_user and usage_14d >= 140,
+        'is_extended_refresh': user.is_thread_depth_locked,
+        'last_usage': user.last_usage_timestamp.isoformat() if user.last_usage_timestamp else None,
+        'usage_limit': 140 if is_free_user else None,
+        'daily_limit': 200 if user.membership == 'PREMIUM' else 10,
+    }
+
+
+def _status_ttl(payload, now):
+    """Keep the entry no longer than the moment its time-derived fields change."""
+    ttl = getattr(settings, 'CREDIT_STATUS_CACHE_TTL', 300)
+    if payload['reset_time']:
+        remaining = (datetime.fromisoformat(payload['reset_time']) - now).total_seconds()
+        if remaining > 0:
+            # Refill becoming due, or days_until_refill ticking down
+            ttl = min(ttl, remaining, remaining % 86400 or 86400)
+        else:
+            ttl = 0
+    return max(int(ttl), 1)
+
+
+def get_credit_status(user):
+    """Return ``(payload, etag)``, from the cache when the user's version still matches."""
+    status_key, version_key = _status_key(user.pk), _version_key(user.pk)
+    try:
+        cached = cache.get_many([status_key, version_key])
+    except Exception as e:
+        logger.warning(f"Credit status cache read failed for user {user.pk}: {e}")
+        cached = None
+    version = cached.get(version_key, 0) if cached is not None else None
+    entry = cached.get(status_key) if cached is not None else None
+    if entry is not None and entry['version'] == version:
+        return entry['payload'], entry['etag']
+
+    # request.user was loaded at authentication, possibly before the version above;
+    # reread its credit columns so the payload is at least as new as that version
+    user.refresh_from_db(fields=STATUS_FIELDS)
+    now = timezone.now()
+    payload = build_credit_status(user, now)
+    body = json.dumps(payload, sort_keys=True, cls=DjangoJSONEncoder)
+    etag = hashlib.sha256(body.encode()).hexdigest()[:32]
+    if version is not None:
+        try:
+            cache.set(
+                status_key,
+                {'version': version, 'payload': payload, 'etag': etag},
+                _status_ttl(payload, now),
+            )
+        except Exception as e:
+            logger.warning(f"Credit status cache write failed for user {user.pk}: {e}")
+    return payload, etag
+
+
+def _bump_versions(pks):
+    for pk in pks:
+        key = _version_key(pk)
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Credit status invalidation failed for user {pk}: {e}")
+
+
+def invalidate_credit_status(*pks):
+    """Drop cached status for these users once the current transaction commits."""
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        transaction.on_commit(lambda: _bump_versions(pks))
@@ -0,0 +1,77 @@
+"""
+Streaming NDJSON export of a user's conversations and messages.
+
+One JSON object per line: each conversation (``"record": "conversation"``)
+is followed by its messages (``"record": "message"``; ``type`` is the
+message's own field), oldest first. Conversations and messages are read
+through two ``.iterator(chunk_size=...)`` cursors (server-side on
+PostgreSQL) that advance together in conversation order, so memory stays
+flat however large the history is. Lines are sent
+in blocks of roughly ``EXPORT_BLOCK_SIZE`` bytes. With ``compress=True``
+the stream is gzip, compressed block by block.
+"""
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+CONVERSATION_FIELDS = [
+    'id', 'uuid', 'title', 'created_at', 'updated_at',
+    'message_count', 'last_message_at',
+]
+MESSAGE_FIELDS = ['conversation_id'] + MessageSerializer.Meta.fields
+
+
+def _line(record, row):
+    return json.dumps({'record': record, **row}, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def export_lines(user, chunk_size=None):
+    """Yield the user's export, one NDJSON line at a time."""
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    conversations = (
+        Conversation.objects.filter(user=user).order_by('id')
+        .values(*CONVERSATION_FIELDS).iterator(chunk_size=chunk_size)
+    )
+    messages = (
+        Message.objects.filter(conversation__user=user)
+        .order_by('conversation_id', 'created_at', 'id')
+        .values(*MESSAGE_FIELDS).iterator(chunk_size=chunk_size)
+    )
+
+    message = next(messages, None)
+    for conversation in conversations:
+        pk = conversation.pop('id')
+        yield _line('conversation', conversation)
+        # Both cursors are in conversation order; skip messages of conversations we didn't see
+        while message is not None and message['conversation_id'] <= pk:
+            if message.pop('conversation_id') == pk:
+                yield _line('message', dict(message, conversation=conversation['uuid']))
+            message = next(messages, None)
+
+
+def export_stream(user, compress=False, chunk_size=None):
+    """Yield the export as byte blocks, gzip-compressed when ``compress`` is set."""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    block, size = [], 0
+    for line in export_lines(user, chunk_size):
+        data = line.encode()
+        block.append(data)
+        size += len(data)
+        if size >= EXPORT_BLOCK_SIZE:
+            data = b''.join(block)
+            block, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(block)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
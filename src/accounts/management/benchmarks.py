@@ -0,0 +1,58 @@
+"""Shared bits of the ``bench_*`` management commands."""
+import statistics
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    elapsed = sum(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1e6
+
+    return {
+        'iterations': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'mean_us': round(statistics.fmean(samples) * 1e6, 1),
+        'p50_us': round(pct(0.50), 1),
+        'p95_us': round(pct(0.95), 1),
+        'p99_us': round(pct(0.99), 1),
+        'max_us': round(ordered[-1] * 1e6, 1),
+    }
+
+
+@contextmanager
+def test_database():
+    """Run against a throwaway test database so benchmarks never touch real data."""
+    old_db_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+
+class QueryCounter:
+    """
+    Count the queries run on ``connection`` inside the block. Unlike
+    CaptureQueriesContext it keeps no log, so it has no 9000-query cap and
+    doesn't force the debug cursor into the timings.
+    """
+
+    def __init__(self, using=connection):
+        self.connection = using
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
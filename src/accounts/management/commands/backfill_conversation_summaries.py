@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+
+from accounts.models import Conversation, Message
+
+SUMMARY_FIELDS = ['message_count', 'last_message_at', 'last_message_preview', 'last_message_type']
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute each conversation's message_count and last-message columns from its "
+        "messages, in pk batches. Message writes keep them current; run this once after "
+        "adding the columns, or to repair drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                Conversation.objects.filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            updated += self.backfill(pks)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Backfilled {updated} conversations (up to pk {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} conversations"))
+
+    def backfill(self, pks):
+        latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+        with transaction.atomic():
+            # Lock the batch so add_messages() waits instead of being overwritten
+            conversations = list(
+                Conversation.objects.select_for_update().filter(pk__in=pks).order_by('pk')
+                .annotate(
+                    latest_at=Subquery(latest.values('created_at')[:1]),
+                    latest_text=Subquery(latest.values('text_content')[:1]),
+                    latest_type=Subquery(latest.values('type')[:1]),
+                )
+            )
+            counts = dict(
+                Message.objects.filter(conversation_id__in=pks)
+                .values_list('conversation_id').annotate(count=Count('id')).order_by()
+            )
+            for conversation in conversations:
+                conversation.message_count = counts.get(conversation.pk, 0)
+                conversation.last_message_at = conversation.latest_at
+                conversation.last_message_preview = Message(text_content=conversation.latest_text).preview()
+                conversation.last_message_type = conversation.latest_type or ''
+            Conversation.objects.bulk_update(conversations, SUMMARY_FIELDS)
+        return len(conversations)
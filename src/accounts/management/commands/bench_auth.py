@@ -0,0 +1,171 @@
+import json
+import platform
+import time
+import uuid
+from contextlib import contextmanager
+
+import django
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import JsonResponse
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+
+from accounts.management.benchmarks import summarize, test_database
+from helpers._mixpanel.client import mixpanel_client
+from helpers.myclerk.auth import ClerkAuthentication
+from helpers.myclerk.decorators import api_login_required
+from helpers.myclerk.identity import local_identities
+from helpers.myclerk.jwks import reset_verifier
+from helpers.myclerk.middleware import ClerkAuthMiddleware
+
+SCENARIOS = ['warm', 'cold', 'invalid', 'new_user']
+TARGETS = ['middleware', 'drf', 'api_login_required']
+
+
+def generate_keypair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    return private_key, public_pem
+
+
+def make_token(private_key, sub, lifetime=3600, kid='bench'):
+    now = int(time.time())
+    claims = {
+        'sub': sub,
+        'iat': now,
+        'nbf': now,
+        'exp': now + lifetime,
+        'azp': 'https://0052.live',
+        'email': f'{sub}@bench.local',
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the Clerk auth layer offline (middleware, DRF authentication and "
+        "api_login_required) and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--output', default='auth-benchmark.json')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS)
+        parser.add_argument('--target', action='append', choices=TARGETS)
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or SCENARIOS
+        targets = options['target'] or TARGETS
+        private_key, public_pem = generate_keypair()
+        forged_key, _ = generate_keypair()
+
+        results = []
+        with self.isolated_environment(public_pem):
+            self.factory = RequestFactory()
+            self.private_key = private_key
+            self.forged_token = make_token(forged_key, 'user_benchmark_forged')
+            for target in targets:
+                for scenario in scenarios:
+                    result = self.run_case(target, scenario, options['iterations'], options['warmup'])
+                    results.append(result)
+                    self.stdout.write(
+                        f"{target:<20} {scenario:<9} "
+                        f"p50={result['p50_us']:>9.1f}us p95={result['p95_us']:>9.1f}us "
+                        f"{result['throughput_rps']:>9.1f} req/s"
+                    )
+
+        report = {
+            'benchmark': 'auth',
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+    @contextmanager
+    def isolated_environment(self, public_pem):
+        """Throwaway test database, local-memory cache and the benchmark keypair."""
+        with test_database():
+            mixpanel_enabled = mixpanel_client.enabled
+            mixpanel_client.enabled = False
+            overrides = override_settings(
+                CLERK_JWT_PUBLIC_KEY=public_pem,
+                CLERK_JWKS_URL=None,
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            )
+            overrides.enable()
+            reset_verifier()
+            local_identities.clear()
+            try:
+                yield
+            finally:
+                overrides.disable()
+                reset_verifier()
+                local_identities.clear()
+                mixpanel_client.enabled = mixpanel_enabled
+
+    def token_for(self, scenario, index):
+        if scenario == 'invalid':
+            # A client retrying a token signed with a key the verifier does not trust
+            return self.forged_token
+        if scenario == 'new_user':
+            return make_token(self.private_key, f'user_{uuid.uuid4().hex}')
+        return make_token(self.private_key, 'user_benchmark_warm')
+
+    def build_call(self, target):
+        def view(request):
+            return JsonResponse({'authenticated': request.user.is_authenticated})
+
+        if target == 'middleware':
+            middleware = ClerkAuthMiddleware(view)
+            return lambda request: middleware(request)
+        if target == 'api_login_required':
+            middleware = ClerkAuthMiddleware(api_login_required(view))
+            return lambda request: middleware(request)
+
+        authenticator = ClerkAuthentication()
+
+        def drf(request):
+            drf_request = Request(request, authenticators=[authenticator])
+            try:
+                return drf_request.user
+            except Exception:
+                return None
+        return drf
+
+    def run_case(self, target, scenario, iterations, warmup):
+        call = self.build_call(target)
+        # Pre-mint tokens so signing cost is not part of the measurement
+        tokens = [self.token_for(scenario, i) for i in range(warmup + iterations)]
+
+        samples = []
+        for index, token in enumerate(tokens):
+            if scenario == 'cold':
+                # Drop every cache: verifier (parsed key, rejections) and identities
+                reset_verifier()
+                local_identities.clear()
+                cache.clear()
+            request = self.factory.get('/api/bench/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            request.session = {}
+            started = time.perf_counter()
+            call(request)
+            if index >= warmup:
+                samples.append(time.perf_counter() - started)
+
+        result = {'target': target, 'scenario': scenario}
+        result.update(summarize(samples))
+        return result
@@ -0,0 +1,215 @@
+import io
+import json
+import platform
+import time
+import uuid
+from datetime import date, time as clock, timedelta
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from accounts.management.benchmarks import summarize, test_database
+from accounts.models import Conversation, CustomUser, Message, Provider, ServiceOffering, Vault
+from accounts.serializers import ConversationSerializer, ProviderSerializer, ProviderWithOfferingsSerializer
+from helpers.fastjson import FastJSONParser, FastJSONRenderer, fast_json_available
+
+PAYLOADS = ['conversation', 'conversation_list', 'providers', 'credit_status']
+
+
+def companion_cards(count):
+    """A search_results blob like the companion_cards messages carry."""
+    return [
+        {
+            'id': index,
+            'name': f'Guide {index}',
+            'bio': 'Local food and nightlife guide. ' * 4,
+            'rating': 4.5 + index / 100,
+            'languages': ['en', 'ja', 'fr'],
+            'offerings': [{'name': 'Walking tour', 'price': 45.0}, {'name': 'Dinner', 'price': 80.5}],
+            'available': index % 2 == 0,
+        }
+        for index in range(count)
+    ]
+
+
+def make_conversation(user, messages):
+    conversation = Conversation.objects.create(user=user, title='Tokyo trip — food & nightlife')
+    rows = []
+    for index in range(messages):
+        kind = index % 4
+        rows.append(Message(
+            conversation=conversation,
+            sender='user' if index % 2 else 'ai',
+            input_type='json' if kind == 3 else 'text',
+            type=('chat', 'chat', 'booking', 'companion_cards')[kind],
+            # Includes non-ASCII text and U+2028, which JSONRenderer escapes
+            text_content=f'Message {index}: こんにちは, café\u2028' + 'lorem ipsum ' * 20,
+            search_results=companion_cards(6) if kind == 3 else None,
+            total_amount=Decimal('129.90') if kind == 2 else None,
+            currency='USD' if kind == 2 else None,
+            payment_status='paid' if kind == 2 else None,
+            booking_date=date(2026, 11, 3) if kind == 2 else None,
+            booking_time=clock(19, 30) if kind == 2 else None,
+        ))
+    Message.objects.bulk_create(rows)
+    return conversation
+
+
+def make_providers(user, count):
+    vault = Vault.objects.create(name=f'benchmark-{uuid.uuid4().hex[:8]}')
+    providers = Provider.objects.bulk_create(
+        Provider(
+            user=user,
+            vault=vault,
+            name=f'Provider {index}',
+            location='Tokyo, Japan',
+            bio='Licensed guide with ten years of experience. ' * 5,
+            specialties=['food', 'nightlife', 'history'],
+            social_profiles=[{'network': 'instagram', 'url': f'https://instagram.com/p{index}'}],
+            availability={'days': ['mon', 'wed', 'fri'], 'hours': '10:00-22:00', 'duration': 3},
+            price_range='$$',
+            languages=['en', 'ja'],
+            experience_years=10,
+        )
+        for index in range(count)
+    )
+    ServiceOffering.objects.bulk_create(
+        ServiceOffering(
+            provider=provider,
+            service_title='Evening food tour',
+            description='Six stops, drinks included.',
+            offerings=[{'name': 'Standard', 'price': 95}],
+            pricing={'basePrice': 95, 'serviceFee': 9.5},
+        )
+        for provider in providers
+    )
+    return Provider.objects.filter(vault=vault).prefetch_related('offerings')
+
+
+def build_payloads(user):
+    """Serializer output as the views hand it to the renderer, plus a raw dict of Python types."""
+    conversation = make_conversation(user, 200)
+    for _ in range(20):
+        make_conversation(user, 20)
+    conversations = Conversation.objects.filter(user=user).prefetch_related('messages')
+    providers = make_providers(user, 100)
+    now = timezone.now()
+    return {
+        'conversation': ConversationSerializer(conversation).data,
+        'conversation_list': ConversationSerializer(conversations, many=True).data,
+        'providers': {
+            'providers': ProviderSerializer(providers, many=True).data,
+            'with_offerings': ProviderWithOfferingsSerializer(providers, many=True).data,
+        },
+        # Views that build dicts by hand pass datetimes, Decimals and UUIDs straight through
+        'credit_status': [
+            {
+                'user': uuid.uuid4(),
+                'remaining_credits': 42,
+                'next_refill': now + timedelta(hours=index),
+                'cost': Decimal('0.23'),
+                'day': now.date(),
+                'at': clock(8, 15, 30, 120),
+            }
+            for index in range(200)
+        ],
+    }
+
+
+def measure(func, iterations, warmup):
+    samples = []
+    for index in range(warmup + iterations):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if index >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rendering and parsing realistic API payloads with DRF's stdlib JSON "
+        "renderer/parser versus helpers.fastjson, check the output is byte-identical, "
+        "and write JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--payload', action='append', choices=PAYLOADS)
+        parser.add_argument('--output', default='json-benchmark.json')
+
+    def handle(self, *args, **options):
+        if not fast_json_available():
+            self.stderr.write(self.style.WARNING(
+                "orjson is not installed: FastJSONRenderer falls back to the stdlib, so expect no gain"
+            ))
+        names = options['payload'] or PAYLOADS
+        iterations, warmup = options['iterations'], options['warmup']
+
+        with test_database():
+            user = CustomUser.objects.create_user(clerk_user_id='user_benchmark_json')
+            payloads = build_payloads(user)
+
+        results = []
+        mismatches = []
+        for name in names:
+            data = payloads[name]
+            stdlib_bytes = JSONRenderer().render(data)
+            fast_bytes = FastJSONRenderer().render(data)
+            identical = stdlib_bytes == fast_bytes
+            parsed_equal = (
+                JSONParser().parse(io.BytesIO(stdlib_bytes))
+                == FastJSONParser().parse(io.BytesIO(stdlib_bytes))
+            )
+            if not (identical and parsed_equal):
+                mismatches.append(name)
+
+            for operation, stdlib, fast in (
+                ('render', lambda: JSONRenderer().render(data), lambda: FastJSONRenderer().render(data)),
+                (
+                    'parse',
+                    lambda: JSONParser().parse(io.BytesIO(stdlib_bytes)),
+                    lambda: FastJSONParser().parse(io.BytesIO(stdlib_bytes)),
+                ),
+            ):
+                timings = {
+                    'stdlib': measure(stdlib, iterations, warmup),
+                    'fast': measure(fast, iterations, warmup),
+                }
+                speedup = round(timings['stdlib']['mean_us'] / timings['fast']['mean_us'], 2)
+                results.append({
+                    'payload': name,
+                    'operation': operation,
+                    'bytes': len(stdlib_bytes),
+                    'identical': identical and parsed_equal,
+                    'speedup': speedup,
+                    **{f'{engine}_{key}': value for engine, stats in timings.items() for key, value in stats.items()},
+                })
+                self.stdout.write(
+                    f"{name:<18} {operation:<6} {len(stdlib_bytes):>8} B  "
+                    f"stdlib p50={timings['stdlib']['p50_us']:>9.1f}us  "
+                    f"fast p50={timings['fast']['p50_us']:>9.1f}us  x{speedup:<5} "
+                    f"{'identical' if identical and parsed_equal else 'MISMATCH'}"
+                )
+
+        report = {
+            'benchmark': 'json',
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'fast_json': fast_json_available(),
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        if mismatches:
+            raise CommandError(f"Fast JSON output differs from the stdlib for: {', '.join(mismatches)}")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
@@ -0,0 +1,115 @@
+import json
+import platform
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.management.benchmarks import QueryCounter, summarize, test_database
+from accounts.models import Conversation, CustomUser, Message
+from accounts.serializers import MessageInputSerializer
+
+PATHS = ['per_row', 'bulk']
+SIZES = [10, 100, 1000]
+
+
+def make_payload(size):
+    return [
+        {
+            'sender': 'user' if index % 2 else 'ai',
+            'input_type': 'text',
+            'type': 'chat',
+            'text_content': f'benchmark message {index} ' + 'lorem ipsum ' * 8,
+        }
+        for index in range(size)
+    ]
+
+
+def insert_per_row(conversation, payload):
+    """What batch_create / batch_update did before: one INSERT per message."""
+    with transaction.atomic():
+        for msg_data in payload:
+            Message.objects.create(
+                conversation=conversation,
+                sender=msg_data.get('sender'),
+                input_type=msg_data.get('input_type', 'text'),
+                type=msg_data.get('type'),
+                text_content=msg_data.get('text_content', ''),
+            )
+        conversation.save()
+
+
+def insert_bulk(conversation, payload):
+    """The current endpoints: validate everything, one bulk_create, one conversation touch."""
+    serializer = MessageInputSerializer(data=payload, many=True)
+    serializer.is_valid(raise_exception=True)
+    with transaction.atomic():
+        serializer.save(conversation=conversation)
+        conversation.save(update_fields=['title', 'updated_at'])
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark inserting a conversation's messages one row at a time versus the "
+        "validated bulk_create path used by batch_create / batch_update, and write JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--size', type=int, action='append', help="Messages per batch (repeatable).")
+        parser.add_argument('--path', action='append', choices=PATHS)
+        parser.add_argument('--output', default='messages-benchmark.json')
+
+    def handle(self, *args, **options):
+        sizes = options['size'] or SIZES
+        paths = options['path'] or PATHS
+        inserts = {'per_row': insert_per_row, 'bulk': insert_bulk}
+
+        results = []
+        with test_database():
+            user = CustomUser.objects.create_user(clerk_user_id='user_benchmark_messages')
+            for size in sizes:
+                payload = make_payload(size)
+                for path in paths:
+                    result = self.run_case(user, inserts[path], payload, options['iterations'], options['warmup'])
+                    result.update({'path': path, 'messages': size})
+                    results.append(result)
+                    self.stdout.write(
+                        f"{path:<8} {size:>5} msgs  p50={result['p50_us'] / 1000:>9.2f}ms "
+                        f"queries={result['queries']:>5} {result['messages_per_s']:>10.0f} msgs/s"
+                    )
+
+        report = {
+            'benchmark': 'messages',
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+    def run_case(self, user, insert, payload, iterations, warmup):
+        samples = []
+        queries = 0
+        for index in range(warmup + iterations):
+            conversation = Conversation.objects.create(user=user, title='benchmark')
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                insert(conversation, payload)
+                elapsed = time.perf_counter() - started
+            if index >= warmup:
+                samples.append(elapsed)
+                queries = counter.count
+            # Keep the table the same size for every sample
+            conversation.delete()
+
+        result = summarize(samples)
+        result['queries'] = queries
+        result['messages_per_s'] = round(len(payload) * len(samples) / sum(samples), 1)
+        return result
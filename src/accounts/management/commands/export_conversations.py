@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.export import export_stream
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream one user's conversations and messages as NDJSON (optionally gzip) to a "
+        "file or stdout, with flat memory use however large their history is."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="Clerk user id, or the numeric pk.")
+        parser.add_argument('--output', help="File to write; defaults to stdout.")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'clerk_user_id': options['user']}
+        try:
+            user = CustomUser.objects.get(**lookup)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user {options['user']}")
+
+        stream = export_stream(user, compress=options['gzip'], chunk_size=options['chunk_size'])
+        if options['output']:
+            written = 0
+            with open(options['output'], 'wb') as f:
+                for block in stream:
+                    f.write(block)
+                    written += len(block)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
+        else:
+            for block in stream:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,53 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.credits import credit_ledger, credit_ledger_enabled
+
+logger = logging.getLogger('goldmage')
+
+
+class Command(BaseCommand):
+    help = "Write Redis credit ledger balances and queued usage history to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Flush one round and exit.")
+        parser.add_argument('--interval', type=float, default=settings.CREDIT_LEDGER_FLUSH_INTERVAL)
+        parser.add_argument('--batch-size', type=int, default=settings.CREDIT_LEDGER_FLUSH_BATCH)
+
+    def handle(self, *args, **options):
+        if not credit_ledger_enabled():
+            raise CommandError("CREDIT_ENGINE is not 'redis'; there is no ledger to flush.")
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while True:
+            users, events = self.drain(options['batch_size'])
+            if users or events:
+                logger.info(f"Flushed credit ledger: {users} users, {events} usage events")
+            if options['once'] or not self.running:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, batch_size):
+        """Flush full batches back to back until the backlog is smaller than one batch."""
+        total_users = total_events = 0
+        while True:
+            try:
+                users, events = credit_ledger.flush(batch_size)
+            except Exception as e:
+                logger.error(f"Credit ledger flush failed: {e}", exc_info=True)
+                return total_users, total_events
+            total_users += users
+            total_events += events
+            if users < batch_size and events < batch_size:
+                return total_users, total_events
+
+    def stop(self, signum, frame):
+        # Finish the current round so nothing already taken from Redis is dropped
+        self.running = False
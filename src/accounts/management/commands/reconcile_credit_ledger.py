@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.credits import credit_ledger, credit_ledger_enabled
+from accounts.credits.ledger import LEDGER_FIELDS
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Redis credit ledger state with accounts_customuser and report drift. "
+        "With --repair, write Redis values to the database (or, with --prefer-db, "
+        "evict the Redis state so it reloads from the database)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true')
+        parser.add_argument('--prefer-db', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not credit_ledger_enabled():
+            raise CommandError("CREDIT_ENGINE is not 'redis'; there is no ledger to reconcile.")
+
+        # Users waiting for the flusher are expected to differ
+        pending = credit_ledger.dirty_users()
+        checked = drifted = repaired = 0
+        batch = []
+        for pk, state in credit_ledger.iter_user_states(count=options['batch_size']):
+            batch.append((pk, state))
+            if len(batch) >= options['batch_size']:
+                c, d, r = self.reconcile(batch, pending, options)
+                checked, drifted, repaired = checked + c, drifted + d, repaired + r
+                batch = []
+        if batch:
+            c, d, r = self.reconcile(batch, pending, options)
+            checked, drifted, repaired = checked + c, drifted + d, repaired + r
+
+        self.stdout.write(
+            f"Checked {checked} ledger users: {drifted} drifted, {repaired} repaired, "
+            f"{len(pending)} pending flush"
+        )
+
+    def reconcile(self, batch, pending, options):
+        rows = {
+            row['pk']: row
+            for row in CustomUser.objects.filter(pk__in=[pk for pk, _ in batch]).values('pk', *LEDGER_FIELDS)
+        }
+        drifted = repaired = 0
+        for pk, state in batch:
+            row = rows.get(pk)
+            if row is None:
+                self.stdout.write(self.style.WARNING(f"user {pk}: in Redis but not in the database"))
+                drifted += 1
+                if options['repair']:
+                    credit_ledger.evict(pk)
+                    repaired += 1
+                continue
+            if pk in pending:
+                continue
+            diff = {
+                name: (row[name], value)
+                for name, value in state.items()
+                if row[name] != value
+            }
+            if not diff:
+                continue
+            drifted += 1
+            details = ", ".join(f"{name}: db={db!r} redis={redis!r}" for name, (db, redis) in diff.items())
+            self.stdout.write(self.style.WARNING(f"user {pk}: {details}"))
+            if options['repair']:
+                if options['prefer_db']:
+                    credit_ledger.evict(pk)
+                else:
+                    CustomUser.objects.filter(pk=pk).update(**state)
+                repaired += 1
+        return len(batch), drifted, repaired
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.credits import credit_ledger, credit_ledger_enabled
+from accounts.models import CustomUser, UsageBucket
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every due credit refill to accounts_customuser in bulk and drop usage "
+        "buckets that left the 14-day window. Reads already report refilled balances "
+        "without writing; this keeps the stored rows current."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        due = CustomUser.objects.refill_due(now)
+        if options['dry_run']:
+            self.stdout.write(f"{due.count()} users are due a refill")
+            return
+
+        refilled = skipped = 0
+        last_pk = 0
+        while True:
+            # Walk due users in pk order so each UPDATE touches a bounded set of rows
+            pks = list(
+                due.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            if credit_ledger_enabled():
+                # Redis state is authoritative for these users and the debit script refills them
+                cached = credit_ledger.cached_users(pks)
+                skipped += len(cached)
+                pks = [pk for pk in pks if pk not in cached]
+            if pks:
+                refilled += CustomUser.objects.refill_credits(now, pks=pks)
+
+        purged = UsageBucket.objects.purge_expired(now)
+        message = f"Refilled {refilled} users"
+        if skipped:
+            message += f" ({skipped} skipped, held in the Redis ledger)"
+        message += f"; purged {purged} expired usage buckets"
+        self.stdout.write(self.style.SUCCESS(message))
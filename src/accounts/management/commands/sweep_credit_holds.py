@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.credits import credit_holds
+
+
+class Command(BaseCommand):
+    help = "Reclaim expired credit holds left behind by requests that never committed or released them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        users, reclaimed = credit_holds.sweep(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Reclaimed {reclaimed} expired holds across {users} users"))
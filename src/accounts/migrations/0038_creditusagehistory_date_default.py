@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0037_rename_date_message_booking_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='creditusagehistory',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
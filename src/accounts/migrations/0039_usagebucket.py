@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+from datetime import timedelta
+
+
+def seed_buckets(apps, schema_editor):
+    # Carry the old counter over as a single bucket on the day it was last bumped,
+    # keyed by local date like UsageBucket.objects.record() and window_total()
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    UsageBucket = apps.get_model('accounts', 'UsageBucket')
+    window_start = timezone.localdate() - timedelta(days=13)
+    users = CustomUser.objects.filter(
+        total_usage_14d__gt=0,
+        last_usage_timestamp__gte=timezone.now() - timedelta(days=15),
+    ).values_list('pk', 'last_usage_timestamp', 'total_usage_14d')
+    buckets = []
+    for pk, last_usage, usage in users.iterator():
+        day = timezone.localdate(last_usage)
+        if day >= window_start:
+            buckets.append(UsageBucket(user_id=pk, day=day, count=usage))
+    UsageBucket.objects.bulk_create(buckets, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0038_creditusagehistory_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'day')},
+            },
+        ),
+        migrations.RunPython(seed_buckets, migrations.RunPython.noop),
+    ]
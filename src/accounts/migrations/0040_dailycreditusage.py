@@ -0,0 +1,70 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    CreditUsageHistory = apps.get_model('accounts', 'CreditUsageHistory')
+    DailyCreditUsage = apps.get_model('accounts', 'DailyCreditUsage')
+    totals = (
+        CreditUsageHistory.objects
+        .annotate(day=TruncDate('date'), model_name=Coalesce('model', Value('')))
+        .values('user_id', 'day', 'event_type', 'kind', 'model_name')
+        .annotate(count=Count('id'), cost=Sum('cost'))
+        .order_by()
+    )
+    DailyCreditUsage.objects.bulk_create(
+        [
+            DailyCreditUsage(
+                user_id=row['user_id'],
+                day=row['day'],
+                event_type=row['event_type'],
+                kind=row['kind'],
+                model=row['model_name'],
+                count=row['count'],
+                cost=row['cost'],
+            )
+            for row in totals.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0039_usagebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCreditUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(max_length=50)),
+                ('kind', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, default='', max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='creditusagehistory',
+            index=models.Index(fields=['user', '-date', '-id'], name='creditusage_user_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailycreditusage',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_credit_usage', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailycreditusage',
+            unique_together={('user', 'day', 'event_type', 'kind', 'model')},
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0040_dailycreditusage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='conversation_user_created_idx'),
+        ),
+    ]
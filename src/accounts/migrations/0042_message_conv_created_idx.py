@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0041_conversation_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ),
+    ]
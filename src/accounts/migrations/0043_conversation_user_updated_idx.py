@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0042_message_conv_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'updated_at'], name='conversation_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0043_conversation_user_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=140),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_type',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
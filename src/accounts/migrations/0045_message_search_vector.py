@@ -0,0 +1,69 @@
+from django.db import migrations
+
+# Kept in the database only (see accounts/search.py); SQLite databases search with the
+# in-memory index instead, so everything here is skipped on other vendors.
+SEARCH_CONFIG = 'english'
+BACKFILL_BATCH = 5000
+
+CREATE_TRIGGER = [
+    f"""
+    CREATE OR REPLACE FUNCTION accounts_message_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.text_content, ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS accounts_message_search_vector_trigger ON accounts_message",
+    """
+    CREATE TRIGGER accounts_message_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF text_content ON accounts_message
+        FOR EACH ROW EXECUTE FUNCTION accounts_message_search_vector_update()
+    """,
+]
+
+BACKFILL = f"""
+UPDATE accounts_message SET search_vector = to_tsvector('{SEARCH_CONFIG}', coalesce(text_content, ''))
+WHERE id IN (SELECT id FROM accounts_message WHERE search_vector IS NULL LIMIT %s)
+"""
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # Nullable with no default: no table rewrite
+        cursor.execute("ALTER TABLE accounts_message ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        for statement in CREATE_TRIGGER:
+            cursor.execute(statement)
+        # Existing rows in short batches, each its own transaction (the migration isn't atomic)
+        while True:
+            cursor.execute(BACKFILL, [BACKFILL_BATCH])
+            if cursor.rowcount < BACKFILL_BATCH:
+                break
+        cursor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS message_search_vector_idx "
+            "ON accounts_message USING gin (search_vector)"
+        )
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER IF EXISTS accounts_message_search_vector_trigger ON accounts_message")
+        cursor.execute("DROP FUNCTION IF EXISTS accounts_message_search_vector_update()")
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS message_search_vector_idx")
+        cursor.execute("ALTER TABLE accounts_message DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0044_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
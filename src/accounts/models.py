@@ -1,11 +1,22 @@
 # from django.conf import settings
-from django.db import models
+from django.db import connection, models, transaction
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal
 from cloudinary.models import CloudinaryField
 import uuid
 
+# Credit policy shared by the per-user methods and the single-statement debit
+CREDIT_REFILL_AMOUNT = 50
+CREDIT_REFILL_DELAY = timedelta(hours=12)
+LOCKED_CREDIT_REFILL_DELAY = timedelta(days=7)
+USAGE_WINDOW = timedelta(days=14)
+THREAD_DEPTH_LIMIT = 650
+
+# Length of Conversation.last_message_preview, shown in the history sidebar
+MESSAGE_PREVIEW_LENGTH = 140
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, clerk_user_id, **extra_fields):
         if not clerk_user_id:
@@ -16,6 +27,43 @@ class CustomUserManager(BaseUserManager):
         user.save()
         return user
 
+    def refill_due(self, now=None):
+        """Users whose refill window has passed but whose row still shows zero credits."""
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(is_thread_depth_locked=False, last_depleted_time__lte=now - CREDIT_REFILL_DELAY)
+            | models.Q(is_thread_depth_locked=True, last_depleted_time__lte=now - LOCKED_CREDIT_REFILL_DELAY),
+            credits=0,
+        )
+
+    def refill_credits(self, now=None, pks=None):
+        """
+        Apply every due refill with one UPDATE per lock state; returns the
+        number of users refilled. The WHERE clause re-checks eligibility, so
+        it is safe to run alongside debits.
+        """
+        from accounts.credits import invalidate_credit_status
+
+        now = now or timezone.now()
+        users = self.refill_due(now)
+        if pks is not None:
+            users = users.filter(pk__in=pks)
+        else:
+            pks = list(users.values_list('pk', flat=True))
+        refilled = users.filter(is_thread_depth_locked=False).update(
+            credits=CREDIT_REFILL_AMOUNT,
+            last_depleted_time=None,
+        )
+        refilled += users.filter(is_thread_depth_locked=True).update(
+            credits=CREDIT_REFILL_AMOUNT,
+            last_depleted_time=None,
+            is_thread_depth_locked=False,
+            total_usage_14d=0,
+        )
+        if refilled:
+            invalidate_credit_status(*pks)
+        return refilled
+
 class CustomUser(AbstractBaseUser):
     # user = models.OneToOneField(User, on_delete=models.CASCADE)
     clerk_user_id = models.CharField(max_length=255, unique=True, db_index=True)
@@ -64,29 +112,112 @@ class CustomUser(AbstractBaseUser):
     
     def add_credits(self, amount):
         """Add credits to user's account"""
-        self.credits += amount
-        self.save()
+        from accounts.credits import credit_ledger_write
+        with credit_ledger_write(self):
+            self.credits += amount
+            self.save()
 
     def use_credit(self, event_type="Message", cost=1, kind="Monthly Credits", model_name=None):
         """Use one credit (EP), returns True if successful, False if no credits left"""
-        # Check and refill credits if it's time
-        self.check_and_refill_credits()
-        if self.credits > 0:
-            self.credits -= 1
-            if self.credits == 0:
-                self.last_depleted_time = timezone.now()  # Start vesting timer
-            self.update_14d_usage()
-            self.check_thread_depth_lock()
-            self.save()
-            CreditUsageHistory.objects.create(
-                user=self,
-                event_type=event_type,
-                cost=cost,
-                kind=kind,
-                model=model_name
-            )
-            return True
-        return False
+        from accounts.credits import credit_ledger, credit_ledger_enabled, invalidate_credit_status
+        if credit_ledger_enabled():
+            # History rows are queued in Redis and written by flush_credit_ledger
+            result = credit_ledger.debit(self, event_type, cost, kind, model_name)
+            if result is not None:
+                success, self.credits = result
+                if success:
+                    invalidate_credit_status(self.pk)
+                return success
+            # Inside credit_ledger_write(): debit the row like the db engine
+
+        now = timezone.now()
+        with transaction.atomic():
+            success, remaining = self.debit_credit(now)
+            if not success:
+                return False
+            if self.membership != 'PREMIUM':
+                self.check_thread_depth_lock(self.update_14d_usage(now))
+            invalidate_credit_status(self.pk)
+        # Inserted now, or queued per worker when CREDIT_HISTORY_MODE = "buffered"
+        from accounts.credits import record_credit_usage
+        record_credit_usage(CreditUsageHistory(
+            user=self,
+            event_type=event_type,
+            cost=cost,
+            kind=kind,
+            model=model_name
+        ))
+        return True
+
+    # SQL fragments for debit_credit(); every SET expression sees the row as it
+    # was before the UPDATE, so the refill step is inlined, not chained.
+    _REFILL_DUE = (
+        "(credits = 0 AND last_depleted_time IS NOT NULL AND last_depleted_time <= "
+        "CASE WHEN is_thread_depth_locked THEN %(locked_refill_before)s ELSE %(refill_before)s END)"
+    )
+    _DEBIT_SQL = (
+        "UPDATE {table} SET"
+        f" credits = (CASE WHEN {_REFILL_DUE} THEN %(refill_amount)s ELSE credits END) - 1,"
+        f" last_depleted_time = CASE WHEN {_REFILL_DUE} THEN NULL"
+        " WHEN credits = 1 THEN %(now)s ELSE last_depleted_time END,"
+        f" total_usage_14d = CASE WHEN {_REFILL_DUE} AND is_thread_depth_locked THEN 0 ELSE total_usage_14d END,"
+        " is_thread_depth_locked = CASE WHEN membership = 'PREMIUM' THEN %(false)s"
+        f" WHEN {_REFILL_DUE} THEN %(false)s ELSE is_thread_depth_locked END,"
+        " last_usage_timestamp = CASE WHEN membership = 'PREMIUM' THEN last_usage_timestamp"
+        " ELSE %(now)s END"
+        f" WHERE id = %(pk)s AND (credits > 0 OR {_REFILL_DUE})"
+        " RETURNING credits, last_depleted_time, total_usage_14d,"
+        " last_usage_timestamp, is_thread_depth_locked"
+    )
+    _DEBIT_RETURNING = [
+        'credits', 'last_depleted_time', 'total_usage_14d',
+        'last_usage_timestamp', 'is_thread_depth_locked',
+    ]
+
+    def debit_credit(self, now=None):
+        """
+        Spend one credit in a single conditional UPDATE ... RETURNING.
+
+        Applies a due refill (lifting an expired thread depth lock),
+        decrements the balance and stamps the depletion and usage times in
+        one statement that touches only those columns, so concurrent debits
+        cannot overspend or lose updates. The 14-day window lives in
+        UsageBucket; see update_14d_usage().
+        Returns ``(success, remaining_credits)`` and refreshes the touched
+        fields on this instance.
+        """
+        now = now or timezone.now()
+        adapt = connection.ops.adapt_datetimefield_value
+        params = {
+            'pk': self.pk,
+            'now': adapt(now),
+            'refill_before': adapt(now - CREDIT_REFILL_DELAY),
+            'locked_refill_before': adapt(now - LOCKED_CREDIT_REFILL_DELAY),
+            'refill_amount': CREDIT_REFILL_AMOUNT,
+            'false': False,
+        }
+        sql = self._DEBIT_SQL.format(table=connection.ops.quote_name(self._meta.db_table))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+
+        if row is None:
+            # No credits and no refill due; nothing was written
+            self.credits = min(self.credits, 0)
+            return False, self.credits
+
+        for name, value in zip(self._DEBIT_RETURNING, row):
+            setattr(self, name, self._from_db(name, value))
+        return True, self.credits
+
+    def _from_db(self, field_name, value):
+        """Apply the backend and field converters the ORM would use on a raw value."""
+        field = self._meta.get_field(field_name)
+        expression = field.get_col(self._meta.db_table)
+        converters = connection.ops.get_db_converters(expression) + field.get_db_converters(connection)
+        for converter in converters:
+            value = converter(value, expression, connection)
+        return value
     
     def get_daily_refill_time(self):
         """no daily refill, change to vesting schedule"""
@@ -94,69 +225,93 @@ class CustomUser(AbstractBaseUser):
             return None  # No refill scheduled, user still has credits
         
         if self.is_thread_depth_locked:
-            return self.last_depleted_time + timedelta(days=7)
+            return self.last_depleted_time + LOCKED_CREDIT_REFILL_DELAY
         else:
-            return self.last_depleted_time + timedelta(hours=8)
+            return self.last_depleted_time + CREDIT_REFILL_DELAY
+
+    def apply_due_refill(self, now=None):
+        """
+        Apply a refill whose window has passed to this instance only.
+
+        Reads use this to report effective credits without writing; the row
+        catches up on the next debit (debit_credit applies the same refill)
+        or when ``manage.py refill_credits`` runs.
+        """
+        refill_time = self.get_daily_refill_time()
+        if refill_time is None or (now or timezone.now()) < refill_time:
+            return False
+        self.credits = CREDIT_REFILL_AMOUNT
+        self.last_depleted_time = None  # Reset depletion time
+        if self.is_thread_depth_locked:
+            self.is_thread_depth_locked = False
+            self.total_usage_14d = 0
+        return True
 
     def check_and_refill_credits(self):
-        now = timezone.now()
-        # Only refill if user has zero credits and a depletion time is set
-        if self.credits == 0 and self.last_depleted_time:
-            if self.is_thread_depth_locked:
-                next_refill = self.last_depleted_time + timedelta(days=7)
-
-            else:
-                next_refill = self.last_depleted_time + timedelta(hours=12)
-
-            if now >= next_refill:
-                # Refill credits
-                self.credits = 50
-                self.last_depleted_time = None  # Reset depletion time
-                if self.is_thread_depth_locked:
-                    self.is_thread_depth_locked = False
-                    self.total_usage_14d = 0
-                self.save()
-                return True
+        """Apply a due refill and persist it."""
+        if self.apply_due_refill():
+            self.save(update_fields=['credits', 'last_depleted_time', 'is_thread_depth_locked', 'total_usage_14d'])
+            from accounts.credits import invalidate_credit_status
+            invalidate_credit_status(self.pk)
+            return True
         return False
 
-    def update_14d_usage(self):
-        """Update 14-day usage tracking (only for free users)"""
+    def update_14d_usage(self, now=None):
+        """
+        Count one use in today's UsageBucket and return the usage over the
+        last 14 days (only for free users). Nothing is saved on the user row.
+        """
         if self.membership == 'PREMIUM':
-            return  # Premium users don't track usage
-
-        now = timezone.now()
-        if self.last_usage_timestamp:
-            # If last usage was more than 14 days ago, reset counter
-            if now - self.last_usage_timestamp > timedelta(days=14):
-                self.total_usage_14d = 0
-            # If last usage was today, increment counter
-            elif self.last_usage_timestamp.date() == now.date():
-                self.total_usage_14d += 1
-        else:
-            self.total_usage_14d = 1
-        
-        self.last_usage_timestamp = now
-        self.save()
-
-    def check_thread_depth_lock(self):
+            return 0  # Premium users don't track usage
+        return UsageBucket.objects.record(self, now)
+
+    def usage_in_window(self, now=None):
+        """Uses in the last 14 days, read from at most USAGE_WINDOW.days buckets"""
+        from accounts.credits import credit_ledger, credit_ledger_enabled
+        if credit_ledger_enabled():
+            usage = credit_ledger.usage_in_window(self.pk, now)
+            if usage is not None:
+                return usage
+        return UsageBucket.objects.window_total(self, now)
+
+    def check_thread_depth_lock(self, usage=None):
         """Check if user should be thread depth locked (only for free users)"""
         if self.membership == 'PREMIUM':
-            self.is_thread_depth_locked = False
-            self.save()
+            if self.is_thread_depth_locked:
+                self.is_thread_depth_locked = False
+                CustomUser.objects.filter(pk=self.pk).update(is_thread_depth_locked=False)
+                from accounts.credits import invalidate_credit_status
+                invalidate_credit_status(self.pk)
             return False
 
-        if self.total_usage_14d >= 650:
+        if usage is None:
+            usage = self.usage_in_window()
+        if usage >= THREAD_DEPTH_LIMIT:
             self.is_thread_depth_locked = True
-            # Reset the 14-day usage counter when thread locked
+            # Reset the 14-day usage window when thread locked
             self.total_usage_14d = 0
-            self.save()
+            CustomUser.objects.filter(pk=self.pk).update(is_thread_depth_locked=True, total_usage_14d=0)
+            UsageBucket.objects.filter(user=self).delete()
             return True
         return False
 
     def get_remaining_credits(self):
-        """Get remaining credits"""
-        self.check_and_refill_credits()  # Check for refill before returning
+        """Get remaining credits, counting a due refill without writing it"""
+        self.load_ledger_state()
+        self.apply_due_refill()
         return self.credits
+
+    def load_ledger_state(self):
+        """Overlay the Redis credit ledger's values on this instance (no-op for the db engine)."""
+        from accounts.credits import credit_ledger, credit_ledger_enabled
+        if not credit_ledger_enabled():
+            return False
+        state = credit_ledger.state(self.pk)
+        if state is None:
+            return False
+        for name, value in state.items():
+            setattr(self, name, value)
+        return True
     
     def initialize_free_credits(self):
         """Initialize free credits for new users"""
@@ -185,7 +340,47 @@ class Conversation(models.Model):
     title = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+    # Summary of the messages, kept current by add_messages() (backfill: manage.py backfill_conversation_summaries)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    last_message_preview = models.CharField(max_length=MESSAGE_PREVIEW_LENGTH, blank=True, default='')
+    last_message_type = models.CharField(max_length=30, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's conversations, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='conversation_user_created_idx'),
+            # Delta sync: conversations changed since a watermark
+            models.Index(fields=['user', 'updated_at'], name='conversation_user_updated_idx'),
+        ]
+
+    def add_messages(self, messages):
+        """
+        Fold newly inserted messages into the summary columns with one UPDATE.
+        The count is incremented in SQL so concurrent writers don't lose rows,
+        and the last-message fields only move forward in time.
+        """
+        if not messages:
+            return
+        last = max(messages, key=lambda message: (message.created_at, message.id))
+        preview = last.preview()
+        newer = models.Q(last_message_at__isnull=True) | models.Q(last_message_at__lte=last.created_at)
+
+        def if_newer(value, field):
+            return models.Case(models.When(newer, then=models.Value(value)), default=models.F(field))
+
+        Conversation.objects.filter(pk=self.pk).update(
+            message_count=models.F('message_count') + len(messages),
+            last_message_at=if_newer(last.created_at, 'last_message_at'),
+            last_message_preview=if_newer(preview, 'last_message_preview'),
+            last_message_type=if_newer(last.type or '', 'last_message_type'),
+        )
+        self.message_count += len(messages)
+        if self.last_message_at is None or self.last_message_at <= last.created_at:
+            self.last_message_at = last.created_at
+            self.last_message_preview = preview
+            self.last_message_type = last.type or ''
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.CharField(max_length=50)  # "user", "assistant", "system"
@@ -227,6 +422,13 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']  # Always get messages in order
+        indexes = [
+            # Keyset pagination of a conversation's messages, in either direction
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ]
+
+    def preview(self):
+        return ' '.join((self.text_content or '').split())[:MESSAGE_PREVIEW_LENGTH]
 
 class FavoriteConversation(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='favorite_conversations')
@@ -244,12 +446,109 @@ class CreditUsageHistory(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='credit_usages')
     event_type = models.CharField(max_length=50)  # e.g., "Message"
     cost = models.DecimalField(max_digits=6, decimal_places=2)  # e.g., 0.23
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(default=timezone.now)  # set explicitly when written in batches
     kind = models.CharField(max_length=50, default="Monthly Credits")  # or "Pay-as-you-go", etc.
     model = models.CharField(max_length=50, blank=True, null=True)  # e.g., "v0-1.5-md"
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Keyset pagination of a user's history, newest first
+            models.Index(fields=['user', '-date', '-id'], name='creditusage_user_date_idx'),
+        ]
+
+class DailyCreditUsageManager(models.Manager):
+    _UPSERT_SQL = (
+        "INSERT INTO {table} (user_id, day, event_type, kind, model, count, cost)"
+        " VALUES (%s, %s, %s, %s, %s, %s, %s)"
+        " ON CONFLICT (user_id, day, event_type, kind, model)"
+        " DO UPDATE SET count = {table}.count + EXCLUDED.count, cost = {table}.cost + EXCLUDED.cost"
+    )
+
+    def add_usage(self, rows):
+        """Fold saved CreditUsageHistory rows into their daily totals."""
+        totals = {}
+        for row in rows:
+            key = (row.user_id, timezone.localdate(row.date), row.event_type, row.kind, row.model or '')
+            count, cost = totals.get(key, (0, 0))
+            totals[key] = (count + 1, cost + Decimal(row.cost))
+        if not totals:
+            return 0
+        ops = connection.ops
+        cost_field = self.model._meta.get_field('cost')
+        params = [
+            (user_id, ops.adapt_datefield_value(day), event_type, kind, model, count,
+             ops.adapt_decimalfield_value(cost, cost_field.max_digits, cost_field.decimal_places))
+            for (user_id, day, event_type, kind, model), (count, cost) in totals.items()
+        ]
+        sql = self._UPSERT_SQL.format(table=ops.quote_name(self.model._meta.db_table))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+        return len(params)
+
+class DailyCreditUsage(models.Model):
+    """Per-day credit usage totals, kept in step with CreditUsageHistory inserts"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='daily_credit_usage')
+    day = models.DateField()
+    event_type = models.CharField(max_length=50)
+    kind = models.CharField(max_length=50)
+    model = models.CharField(max_length=50, blank=True, default='')  # '' when the event had no model
+    count = models.PositiveIntegerField(default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = DailyCreditUsageManager()
+
+    class Meta:
+        unique_together = ('user', 'day', 'event_type', 'kind', 'model')
+
+class UsageBucketManager(models.Manager):
+    # One statement: bump today's bucket and return it plus the earlier days
+    # of the window (the subquery only reads days before today).
+    _RECORD_SQL = (
+        "INSERT INTO {table} (user_id, day, count) VALUES (%(user_id)s, %(day)s, 1)"
+        " ON CONFLICT (user_id, day) DO UPDATE SET count = {table}.count + 1"
+        " RETURNING count, count + (SELECT COALESCE(SUM(count), 0) FROM {table}"
+        " WHERE user_id = %(user_id)s AND day >= %(window_start)s AND day < %(day)s)"
+    )
+
+    def window_start(self, today):
+        return today - timedelta(days=USAGE_WINDOW.days - 1)
+
+    def record(self, user, now=None):
+        """Add one use to today's bucket; returns the user's usage in the window."""
+        today = timezone.localdate(now or timezone.now())
+        window_start = self.window_start(today)
+        adapt = connection.ops.adapt_datefield_value
+        params = {'user_id': user.pk, 'day': adapt(today), 'window_start': adapt(window_start)}
+        sql = self._RECORD_SQL.format(table=connection.ops.quote_name(self.model._meta.db_table))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            count, usage = cursor.fetchone()
+        if count == 1:
+            # First use today: expire this user's buckets that left the window
+            self.filter(user=user, day__lt=window_start).delete()
+        return usage
+
+    def window_total(self, user, now=None):
+        today = timezone.localdate(now or timezone.now())
+        return self.filter(user=user, day__gte=self.window_start(today)).aggregate(
+            total=models.Sum('count')
+        )['total'] or 0
+
+    def purge_expired(self, now=None):
+        today = timezone.localdate(now or timezone.now())
+        return self.filter(day__lt=self.window_start(today)).delete()[0]
+
+class UsageBucket(models.Model):
+    """Per-user, per-day use counts backing the 14-day thread depth window"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='usage_buckets')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UsageBucketManager()
+
+    class Meta:
+        unique_together = ('user', 'day')
 
 class Vault(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -0,0 +1,181 @@
+"""
+Serializer-free reads for the hot GET endpoints.
+
+A ``Projection`` is compiled once from a read serializer. It builds that
+serializer's output straight from ``.values()`` rows: the same keys in the
+same order, with the same value conversions. Plain fields (strings,
+integers, booleans, choices, JSON, primary keys) are copied as-is. Fields
+with a real representation (dates, times, decimals, UUIDs) reuse the
+serializer field's own ``to_representation``, minus the per-object field
+lookup and model instantiation; datetimes and files are converted inline
+the same way DRF does. Nested serializers
+become one extra ``.values()`` query, and method fields must be backed by
+a queryset annotation. Any other field type fails at import, so a
+serializer change can't silently diverge.
+
+``API_READ_PROJECTIONS`` switches the endpoints between this and the
+serializers. ``ProjectionParityTests`` in accounts/tests.py checks that
+the rendered bytes are identical.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, relations, serializers
+from rest_framework.settings import api_settings
+
+from .serializers import (
+    ConversationSerializer,
+    MessageSerializer,
+    ProviderWithOfferingsSerializer,
+    ServiceOfferingSummarySerializer,
+)
+
+# to_representation returns the value .values() already gives
+PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.FloatField,
+)
+CONVERTED_FIELDS = (
+    serializers.DateField,
+    serializers.TimeField,
+    serializers.DecimalField,
+    serializers.UUIDField,
+)
+
+
+def projections_enabled():
+    return getattr(settings, 'API_READ_PROJECTIONS', True)
+
+
+def _file_converter(field, model_field):
+    storage = model_field.storage
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+    def convert(name, context):
+        # FileField.to_representation on the FieldFile that name would make
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        request = context['request']
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return convert
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if hasattr(field, 'timezone') or output_format is None or output_format.lower() != ISO_8601:
+        return lambda value, context: field.to_representation(value)
+
+    def convert(value, context):
+        # DateTimeField.to_representation, with the current timezone looked up
+        # once per response instead of once per value
+        tz = context['timezone']
+        if tz is None or not timezone.is_aware(value):
+            return field.to_representation(value)
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+def _compile(model, name, field):
+    """``None`` for a copied value, else ``convert(value, context)``."""
+    if isinstance(field, serializers.FileField):
+        return _file_converter(field, model._meta.get_field(field.source))
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, serializers.JSONField):
+        return None if not field.binary else (lambda value, context, field=field: field.to_representation(value))
+    if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+        return None
+    if isinstance(field, PASSTHROUGH_FIELDS):
+        return None
+    if isinstance(field, CONVERTED_FIELDS):
+        represent = field.to_representation
+        return lambda value, context: represent(value)
+    raise ImproperlyConfigured(
+        f"Projection of {model.__name__} can't reproduce field {name!r} ({type(field).__name__})"
+    )
+
+
+class Projection:
+    def __init__(self, serializer_class, nested=None, annotations=None):
+        """
+        ``nested`` maps a nested serializer field to ``(Projection, foreign key
+        on the child)``; ``annotations`` maps a SerializerMethodField to the
+        queryset annotation that replaces it.
+        """
+        self.model = serializer_class.Meta.model
+        self.pk = self.model._meta.pk.name
+        self.nested = nested or {}
+        annotations = annotations or {}
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if name in self.nested:
+                self.fields.append((name, None, None))
+            elif name in annotations:
+                self.fields.append((name, annotations[name], None))
+            elif isinstance(field, serializers.SerializerMethodField):
+                raise ImproperlyConfigured(f"Projection of {self.model.__name__} needs an annotation for {name!r}")
+            else:
+                self.fields.append((name, field.source, _compile(self.model, name, field)))
+        self.columns = [column for _, column, _ in self.fields if column is not None]
+        if self.nested and self.pk not in self.columns:
+            self.columns.append(self.pk)
+
+    def values(self, queryset, *extra):
+        return queryset.values(*self.columns, *extra)
+
+    def represent(self, rows, request=None):
+        """The serializer's ``many=True`` output for these ``values()`` rows."""
+        context = {
+            'request': request,
+            'timezone': timezone.get_current_timezone() if settings.USE_TZ else None,
+        }
+        return self._represent(list(rows), context)
+
+    def _represent(self, rows, context):
+        children = {name: self._children(name, rows, context) for name in self.nested}
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in self.fields:
+                if column is None:
+                    item[name] = children[name].get(row[self.pk], [])
+                    continue
+                value = row[column]
+                item[name] = value if convert is None or value is None else convert(value, context)
+            data.append(item)
+        return data
+
+    def _children(self, name, rows, context):
+        projection, foreign_key = self.nested[name]
+        if not rows:
+            return {}
+        # The related manager's query, so default ordering matches the serializer
+        child_rows = list(projection.values(
+            projection.model._default_manager.filter(**{f'{foreign_key}__in': [row[self.pk] for row in rows]}),
+            foreign_key,
+        ))
+        grouped = {}
+        for child_row, item in zip(child_rows, projection._represent(child_rows, context)):
+            grouped.setdefault(child_row[foreign_key], []).append(item)
+        return grouped
+
+
+message_projection = Projection(MessageSerializer)
+conversation_projection = Projection(
+    ConversationSerializer,
+    nested={'messages': (message_projection, 'conversation')},
+    annotations={'is_favorite': 'is_favorite'},  # ConversationListCreateView.with_favorite()
+)
+provider_projection = Projection(
+    ProviderWithOfferingsSerializer,
+    nested={'offerings': (Projection(ServiceOfferingSummarySerializer), 'provider')},
+)
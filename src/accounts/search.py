@@ -0,0 +1,246 @@
+"""
+Full-text search over a user's conversations and messages.
+
+On PostgreSQL, ``accounts_message.search_vector`` holds
+``to_tsvector('english', text_content)``. A trigger fills it on insert and
+on edits of ``text_content``, bulk_create included, and a GIN index serves
+``@@`` (migration 0045). The column lives only in the database, not on the
+``Message`` model, so the ORM never selects or writes it. Queries use
+``websearch_to_tsquery`` syntax, so quotes, ``or`` and ``-word`` work.
+Hits are ranked with ``ts_rank_cd`` and highlighted with ``ts_headline``.
+
+Other databases (SQLite in development) fall back to ``InMemorySearchIndex``,
+a per-process inverted index over the user's messages. It is rebuilt when
+their messages or titles change, does no stemming, and requires every
+query word to match. It is meant for offline development, not production
+volumes.
+
+Both backends scope every query to ``request.user``. Results are grouped by
+conversation, best match first.
+"""
+import html
+import math
+import re
+import threading
+
+from django.db import connection
+from django.db.models import Count, Max
+
+from .models import Conversation, Message
+
+SEARCH_CONFIG = 'english'
+
+# Highlights are delimited with private-use characters, escaped, then turned into <mark>,
+# so message text can never inject markup into a highlight
+MARK_START, MARK_STOP = '\ue000', '\ue001'
+HEADLINE_OPTIONS = f'StartSel={MARK_START}, StopSel={MARK_STOP}, MaxWords=30, MinWords=10, MaxFragments=2'
+
+MESSAGE_HITS_SQL = """
+SELECT hit.id, hit.conversation_id, hit.rank, m.created_at, m.sender, m.type,
+       ts_headline(%(config)s::regconfig, coalesce(m.text_content, ''), hit.query, %(options)s) AS headline
+FROM (
+    SELECT m.id, m.conversation_id, ts_rank_cd(m.search_vector, q) AS rank, q AS query
+    FROM {message} m
+    JOIN {conversation} c ON c.id = m.conversation_id,
+         websearch_to_tsquery(%(config)s::regconfig, %(query)s) q
+    WHERE c.user_id = %(user_id)s AND m.search_vector @@ q
+    ORDER BY rank DESC, m.id DESC
+    LIMIT %(limit)s
+) hit
+JOIN {message} m ON m.id = hit.id
+ORDER BY hit.rank DESC, hit.id DESC
+"""
+
+# A user's titles are few; matching them needs no index beyond the user lookup
+TITLE_HITS_SQL = """
+SELECT c.id, ts_rank_cd(to_tsvector(%(config)s::regconfig, c.title), q) AS rank,
+       ts_headline(%(config)s::regconfig, c.title, q, %(options)s) AS headline
+FROM {conversation} c, websearch_to_tsquery(%(config)s::regconfig, %(query)s) q
+WHERE c.user_id = %(user_id)s AND to_tsvector(%(config)s::regconfig, c.title) @@ q
+"""
+
+
+def _mark(text):
+    return html.escape(text).replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>')
+
+
+class PostgresSearch:
+    def search(self, user, query, limit):
+        """Return ``(message_hits, title_hits)`` as lists of dicts."""
+        quote = connection.ops.quote_name
+        tables = {
+            'message': quote(Message._meta.db_table),
+            'conversation': quote(Conversation._meta.db_table),
+        }
+        params = {
+            'config': SEARCH_CONFIG,
+            'options': HEADLINE_OPTIONS,
+            'query': query,
+            'user_id': user.pk,
+            'limit': limit,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(MESSAGE_HITS_SQL.format(**tables), params)
+            columns = [column[0] for column in cursor.description]
+            messages = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.execute(TITLE_HITS_SQL.format(**tables), params)
+            titles = [
+                {'conversation_id': pk, 'rank': rank, 'headline': headline}
+                for pk, rank, headline in cursor.fetchall()
+            ]
+        return messages, titles
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class InMemorySearchIndex:
+    """Per-user inverted indexes (token -> {doc id: term count}), rebuilt when the user's data changes."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def search(self, user, query, limit):
+        terms = set(tokenize(query))
+        if not terms:
+            return [], []
+        index = self._index_for(user)
+        scored = self._score(index['messages'], terms)[:limit]
+        messages = [
+            dict(index['rows'][pk], id=pk, rank=rank, headline=self._headline(index['rows'][pk]['text'], terms))
+            for pk, rank in scored
+        ]
+        titles = [
+            {'conversation_id': pk, 'rank': rank, 'headline': self._headline(index['titles'][pk], terms)}
+            for pk, rank in self._score(index['title_postings'], terms)
+        ]
+        return messages, titles
+
+    def _stamp(self, user):
+        messages = Message.objects.filter(conversation__user=user).aggregate(last=Max('id'), count=Count('id'))
+        conversations = Conversation.objects.filter(user=user).aggregate(updated=Max('updated_at'), count=Count('id'))
+        return messages['last'], messages['count'], conversations['updated'], conversations['count']
+
+    def _index_for(self, user):
+        stamp = self._stamp(user)
+        with self._lock:
+            cached = self._indexes.get(user.pk)
+            if cached is not None and cached['stamp'] == stamp:
+                return cached
+
+        rows, postings = {}, {}
+        for row in (
+            Message.objects.filter(conversation__user=user)
+            .values('id', 'conversation_id', 'created_at', 'sender', 'type', 'text_content')
+            .iterator()
+        ):
+            pk = row.pop('id')
+            row['text'] = row.pop('text_content') or ''
+            rows[pk] = row
+            for token in tokenize(row['text']):
+                counts = postings.setdefault(token, {})
+                counts[pk] = counts.get(pk, 0) + 1
+
+        titles, title_postings = {}, {}
+        for pk, title in Conversation.objects.filter(user=user).values_list('id', 'title'):
+            titles[pk] = title
+            for token in tokenize(title):
+                counts = title_postings.setdefault(token, {})
+                counts[pk] = counts.get(pk, 0) + 1
+
+        index = {
+            'stamp': stamp,
+            'rows': rows,
+            'messages': (postings, len(rows)),
+            'titles': titles,
+            'title_postings': (title_postings, len(titles)),
+        }
+        with self._lock:
+            self._indexes[user.pk] = index
+        return index
+
+    def _score(self, index, terms):
+        """Docs containing every term, scored by tf-idf, best first."""
+        postings, total = index
+        matches = [postings.get(term, {}) for term in terms]
+        if not all(matches):
+            return []
+        docs = set.intersection(*(set(match) for match in matches))
+        scores = {
+            pk: sum(match[pk] * math.log(1 + total / len(match)) for match in matches)
+            for pk in docs
+        }
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+    def _headline(self, text, terms, width=30):
+        # Words and the separators between them, so the fragment keeps the original spacing
+        tokens = re.split(r'(\w+)', text)
+        positions = [index for index, token in enumerate(tokens) if token.lower() in terms]
+        start = max(0, positions[0] - width) if positions else 0
+        fragment = tokens[start:start + 2 * width]
+        return ''.join(
+            f'{MARK_START}{token}{MARK_STOP}' if token.lower() in terms else token
+            for token in fragment
+        ).strip()
+
+
+memory_index = InMemorySearchIndex()
+
+
+def search_backend():
+    return PostgresSearch() if connection.vendor == 'postgresql' else memory_index
+
+
+def search_conversations(user, query, limit=50):
+    """
+    Search ``user``'s messages and conversation titles; returns the matching
+    conversations, best first, each with its matching messages (best first,
+    at most ``limit`` messages overall).
+    """
+    message_hits, title_hits = search_backend().search(user, query, limit)
+
+    groups = {}
+    for hit in title_hits:
+        groups[hit['conversation_id']] = {
+            'rank': float(hit['rank']),
+            'title_highlight': _mark(hit['headline']),
+            'messages': [],
+        }
+    for hit in message_hits:
+        group = groups.setdefault(hit['conversation_id'], {'rank': 0.0, 'title_highlight': None, 'messages': []})
+        group['rank'] = max(group['rank'], float(hit['rank']))
+        group['messages'].append({
+            'id': hit['id'],
+            'created_at': hit['created_at'].isoformat(),
+            'sender': hit['sender'],
+            'type': hit['type'],
+            'rank': round(float(hit['rank']), 6),
+            'highlight': _mark(hit['headline']),
+        })
+
+    conversations = {
+        row['id']: row
+        for row in Conversation.objects.filter(user=user, pk__in=groups).values(
+            'id', 'uuid', 'title', 'created_at', 'message_count', 'last_message_at',
+        )
+    }
+    results = []
+    for pk, group in sorted(groups.items(), key=lambda item: (-item[1]['rank'], -item[0])):
+        conversation = conversations.get(pk)
+        if conversation is None:
+            continue
+        results.append({
+            'conversation': {
+                'uuid': str(conversation['uuid']),
+                'title': conversation['title'],
+                'created_at': conversation['created_at'].isoformat(),
+                'message_count': conversation['message_count'],
+                'last_message_at': conversation['last_message_at'].isoformat() if conversation['last_message_at'] else None,
+            },
+            'rank': round(group['rank'], 6),
+            'title_highlight': group['title_highlight'],
+            'messages': group['messages'],
+        })
+    return results
@@ -26,19 +26,54 @@ class MessageSerializer(serializers.ModelSerializer):
             'created_at'
         ]
 
+class BulkMessageListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        # One multi-row INSERT; primary keys come back on PostgreSQL and SQLite
+        return Message.objects.bulk_create([Message(**attrs) for attrs in validated_data])
+
+class MessageInputSerializer(serializers.ModelSerializer):
+    """Validates messages posted to batch_create / batch_update before anything is written"""
+    input_type = serializers.ChoiceField(choices=Message._meta.get_field('input_type').choices, default='text')
+    text_content = serializers.CharField(required=False, allow_blank=True, allow_null=True, default='')
+    image = serializers.CharField(required=False, allow_blank=True, allow_null=True)  # stored path, not an upload
+
+    class Meta:
+        model = Message
+        fields = [
+            'sender',
+            'input_type',
+            'type',
+            'text_content',
+            'image',
+            'total_amount',
+            'currency',
+            'payment_status',
+            'companion_id',
+            'booking_date',
+            'booking_time',
+        ]
+        list_serializer_class = BulkMessageListSerializer
+
 class ConversationSerializer(serializers.ModelSerializer):
     messages = MessageSerializer(many=True, read_only=True)
     is_favorite = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ['id', 'uuid', 'title', 'created_at', 'updated_at', 'messages', 'is_favorite']
+        fields = [
+            'id', 'uuid', 'title', 'created_at', 'updated_at', 'messages', 'is_favorite',
+            'message_count', 'last_message_at', 'last_message_preview', 'last_message_type',
+        ]
+        read_only_fields = ['message_count', 'last_message_at', 'last_message_preview', 'last_message_type']
         extra_kwargs = {
             'user': {'read_only': True},
             'uuid': {'read_only': True}
         }
     
     def get_is_favorite(self, obj):
+        if hasattr(obj, 'is_favorite'):
+            # Annotated by ConversationListCreateView.with_favorite()
+            return obj.is_favorite
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return FavoriteConversation.objects.filter(
@@ -48,6 +83,33 @@ class ConversationSerializer(serializers.ModelSerializer):
         return False
 
 
+class ConversationDetailSerializer(ConversationSerializer):
+    """Conversation metadata plus its latest page of messages; older pages come from the messages endpoint"""
+    messages = serializers.SerializerMethodField()
+    messages_cursor = serializers.SerializerMethodField()
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ConversationSerializer.Meta.fields + ['messages_cursor']
+
+    def get_messages(self, obj):
+        # Set by ConversationListCreateView.retrieve()
+        return MessageSerializer(obj.latest_messages, many=True, context=self.context).data
+
+    def get_messages_cursor(self, obj):
+        return obj.messages_cursor
+
+
+class ConversationSyncSerializer(ConversationSerializer):
+    """Conversation metadata only; sync deltas attach just the new messages"""
+    messages = None
+
+    class Meta(ConversationSerializer.Meta):
+        fields = [
+            'id', 'uuid', 'title', 'created_at', 'updated_at', 'is_favorite',
+            'message_count', 'last_message_at', 'last_message_preview', 'last_message_type',
+        ]
+
+
 class FavoriteConversationSerializer(serializers.ModelSerializer):
     conversation = ConversationSerializer(read_only=True)
     
@@ -0,0 +1,149 @@
+"""
+Delta sync of conversations and messages.
+
+Messages are append-only and their ids only grow, so a client that
+remembers the last message id it has seen, plus the last conversation
+``updated_at`` (titles change in place), can be sent just what changed
+since. That pair travels as an opaque watermark token. A token is scoped
+to one conversation or to all of a user's conversations, and is rejected
+by the other scope, since a per-conversation message id says nothing
+about the user's other conversations.
+
+Message ids are assigned at INSERT, not at commit, and a send keeps its
+transaction open across the AI call, so a lower id can become visible
+after a higher one was already synced. The watermark therefore also
+carries ``settled_id``: the highest id whose message is older than
+``CONVERSATION_SYNC_OVERLAP`` seconds. Every sync re-sends the messages
+above it (up to ``message_id``) along with the new ones, and conversations
+updated within the overlap. Guarantee: no message is ever skipped as long
+as the transaction that inserts it commits within the overlap; in return
+a message may arrive more than once, so clients dedupe messages by ``id``
+and conversations by ``uuid``.
+
+Deleted conversations are not reported; clients still drop those when a
+conversation 404s.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Message
+
+
+def sync_overlap():
+    return timedelta(seconds=getattr(settings, 'CONVERSATION_SYNC_OVERLAP', 300))
+
+
+class Watermark:
+    def __init__(self, scope=None, message_id=0, updated_at=None, settled_id=None):
+        self.scope = scope  # conversation uuid as a string, or None for every conversation
+        self.message_id = message_id  # highest id sent; the next page starts after it
+        self.updated_at = updated_at
+        # Ids up to here are old enough that every lower id has committed
+        self.settled_id = message_id if settled_id is None else min(settled_id, message_id)
+
+    def encode(self):
+        payload = json.dumps(
+            [
+                self.scope, self.message_id,
+                self.updated_at.isoformat() if self.updated_at else None,
+                self.settled_id,
+            ],
+            separators=(',', ':'),
+        )
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token, scope=None):
+        """Parse a client's token; a missing one means "from the beginning"."""
+        if not token:
+            return cls(scope)
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            # Tokens issued before settled_id existed have three fields
+            token_scope, message_id, updated_at, *settled_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            message_id = int(message_id)
+            updated_at = parse_datetime(updated_at) if updated_at else None
+            settled_id = int(settled_id[0]) if settled_id else None
+        except (ValueError, TypeError):
+            raise ValidationError({'watermark': 'Invalid watermark.'})
+        if token_scope != scope:
+            raise ValidationError({'watermark': 'Watermark belongs to a different sync scope.'})
+        return cls(scope, message_id, updated_at, settled_id)
+
+    @classmethod
+    def current(cls, conversation):
+        """Where a conversation stands right now; taken before a write so the write's delta is everything after."""
+        cutoff = timezone.now() - sync_overlap()
+        ids = conversation.messages.aggregate(
+            last_id=Max('id'),
+            settled_id=Max('id', filter=Q(created_at__lte=cutoff)),
+        )
+        return cls(str(conversation.uuid), ids['last_id'] or 0, conversation.updated_at, ids['settled_id'] or 0)
+
+
+def build_delta(conversations, watermark, limit):
+    """
+    Conversations changed since ``watermark``, each carrying its new messages
+    (oldest first), and the watermark to send next time.
+
+    At most ``limit`` new messages are returned, oldest first; ``has_more``
+    says the client should call again with the new watermark right away.
+    Messages between the watermark's ``settled_id`` and ``message_id`` are
+    re-sent on top of those (see the module docstring).
+    """
+    from .serializers import ConversationSyncSerializer, MessageSerializer
+
+    # Taken before the reads: whatever is settled by then has committed before them
+    cutoff = timezone.now() - sync_overlap()
+    recent = Message.objects.filter(conversation__in=conversations).order_by('id')
+    resent = list(recent.filter(id__gt=watermark.settled_id, id__lte=watermark.message_id))
+    messages = list(recent.filter(id__gt=watermark.message_id)[:limit + 1])
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    # Every message above the old settled_id is in resent + messages, so the
+    # newest settled one among them bounds what can still be in flight
+    settled_id = max(
+        (message.id for message in resent + messages if message.created_at <= cutoff),
+        default=watermark.settled_id,
+    )
+
+    if watermark.updated_at is None:
+        changed = Q()  # first sync: every conversation
+    else:
+        changed = Q(updated_at__gt=watermark.updated_at - sync_overlap())
+        changed |= Q(pk__in={message.conversation_id for message in resent + messages})
+    changed_conversations = list(conversations.filter(changed).order_by('updated_at', 'id'))
+
+    by_conversation = {}
+    for message in resent + messages:
+        by_conversation.setdefault(message.conversation_id, []).append(message)
+
+    payload = []
+    for conversation in changed_conversations:
+        data = ConversationSyncSerializer(conversation).data
+        data['messages'] = MessageSerializer(by_conversation.get(conversation.pk, []), many=True).data
+        payload.append(data)
+
+    next_watermark = Watermark(
+        watermark.scope,
+        messages[-1].id if messages else watermark.message_id,
+        max(
+            [conversation.updated_at for conversation in changed_conversations]
+            + ([watermark.updated_at] if watermark.updated_at else []),
+            default=None,
+        ),
+        settled_id,
+    )
+    return {
+        'conversations': payload,
+        'watermark': next_watermark.encode(),
+        'has_more': has_more,
+    }
@@ -0,0 +1,408 @@
+import base64
+import json
+import random
+import threading
+from datetime import date, time as clock, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import (
+    CREDIT_REFILL_AMOUNT,
+    CREDIT_REFILL_DELAY,
+    LOCKED_CREDIT_REFILL_DELAY,
+    Conversation,
+    CustomUser,
+    FavoriteConversation,
+    Message,
+    Provider,
+    ServiceOffering,
+    Vault,
+)
+from .projections import conversation_projection, message_projection, provider_projection
+from .serializers import ConversationSerializer, MessageSerializer, ProviderWithOfferingsSerializer
+from .sync import Watermark, build_delta
+from .views import ConversationListCreateView, ProviderViewSet
+
+DEBIT_FIELDS = ['credits', 'last_depleted_time', 'total_usage_14d', 'last_usage_timestamp', 'is_thread_depth_locked']
+
+
+class DebitCreditTests(TestCase):
+    """CustomUser.debit_credit(), the single-statement debit behind use_credit()."""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+
+    def make_user(self, **fields):
+        user = CustomUser.objects.create_user(clerk_user_id=f'user_debit_{CustomUser.objects.count()}')
+        CustomUser.objects.filter(pk=user.pk).update(**fields)
+        user.refresh_from_db()
+        return user
+
+    def assertRowMatches(self, user):
+        row = CustomUser.objects.values(*DEBIT_FIELDS).get(pk=user.pk)
+        self.assertEqual(row, {name: getattr(user, name) for name in DEBIT_FIELDS})
+
+    def test_debit_decrements_and_stamps_usage(self):
+        user = self.make_user(credits=5)
+        self.assertEqual(user.debit_credit(self.now), (True, 4))
+        self.assertEqual(user.last_usage_timestamp, self.now)
+        self.assertIsNone(user.last_depleted_time)
+        self.assertRowMatches(user)
+
+    def test_last_credit_starts_the_refill_timer(self):
+        user = self.make_user(credits=1)
+        self.assertEqual(user.debit_credit(self.now), (True, 0))
+        self.assertEqual(user.last_depleted_time, self.now)
+        self.assertEqual(user.get_daily_refill_time(), self.now + CREDIT_REFILL_DELAY)
+        self.assertRowMatches(user)
+
+    def test_no_credits_and_no_refill_due(self):
+        depleted = self.now - CREDIT_REFILL_DELAY + timedelta(minutes=1)
+        user = self.make_user(credits=0, last_depleted_time=depleted)
+        self.assertEqual(user.debit_credit(self.now), (False, 0))
+        user.refresh_from_db()
+        self.assertEqual(user.credits, 0)
+        self.assertEqual(user.last_depleted_time, depleted)
+        self.assertIsNone(user.last_usage_timestamp)
+
+    def test_no_credits_and_never_depleted(self):
+        user = self.make_user(credits=0, last_depleted_time=None)
+        self.assertEqual(user.debit_credit(self.now), (False, 0))
+
+    def test_due_refill_is_applied_then_debited(self):
+        user = self.make_user(credits=0, last_depleted_time=self.now - CREDIT_REFILL_DELAY)
+        self.assertEqual(user.debit_credit(self.now), (True, CREDIT_REFILL_AMOUNT - 1))
+        self.assertIsNone(user.last_depleted_time)
+        self.assertRowMatches(user)
+
+    def test_locked_user_waits_for_the_longer_refill(self):
+        depleted = self.now - CREDIT_REFILL_DELAY - timedelta(hours=1)
+        user = self.make_user(credits=0, last_depleted_time=depleted, is_thread_depth_locked=True)
+        self.assertEqual(user.debit_credit(self.now), (False, 0))
+        user.refresh_from_db()
+        self.assertTrue(user.is_thread_depth_locked)
+
+    def test_locked_refill_lifts_the_lock_and_resets_usage(self):
+        user = self.make_user(
+            credits=0,
+            last_depleted_time=self.now - LOCKED_CREDIT_REFILL_DELAY,
+            is_thread_depth_locked=True,
+            total_usage_14d=640,
+        )
+        self.assertEqual(user.debit_credit(self.now), (True, CREDIT_REFILL_AMOUNT - 1))
+        self.assertFalse(user.is_thread_depth_locked)
+        self.assertEqual(user.total_usage_14d, 0)
+        self.assertRowMatches(user)
+
+    def test_premium_is_unlocked_and_usage_not_stamped(self):
+        last_usage = self.now - timedelta(days=3)
+        user = self.make_user(
+            membership='PREMIUM', credits=10, is_thread_depth_locked=True, last_usage_timestamp=last_usage,
+        )
+        self.assertEqual(user.debit_credit(self.now), (True, 9))
+        self.assertFalse(user.is_thread_depth_locked)
+        self.assertEqual(user.last_usage_timestamp, last_usage)
+        self.assertRowMatches(user)
+
+    def test_stale_instances_cannot_overspend(self):
+        user = self.make_user(credits=1)
+        other = CustomUser.objects.get(pk=user.pk)
+        self.assertEqual(user.debit_credit(self.now), (True, 0))
+        # ``other`` still believes there is one credit left
+        self.assertEqual(other.debit_credit(self.now), (False, 0))
+        user.refresh_from_db()
+        self.assertEqual(user.credits, 0)
+        self.assertEqual(user.last_depleted_time, self.now)
+
+    def test_matches_the_in_memory_policy(self):
+        """Randomized states against apply_due_refill() plus the plain decrement."""
+        rng = random.Random(8)
+        offsets = [
+            None,
+            CREDIT_REFILL_DELAY - timedelta(minutes=1),
+            CREDIT_REFILL_DELAY,
+            LOCKED_CREDIT_REFILL_DELAY - timedelta(minutes=1),
+            LOCKED_CREDIT_REFILL_DELAY,
+        ]
+        for _ in range(200):
+            offset = rng.choice(offsets)
+            state = {
+                'membership': rng.choice(['FREE', 'PREMIUM']),
+                'credits': rng.choice([0, 0, 1, 2, 50]),
+                'last_depleted_time': None if offset is None else self.now - offset,
+                'is_thread_depth_locked': rng.random() < 0.3,
+                'total_usage_14d': rng.choice([0, 10, 649]),
+                'last_usage_timestamp': rng.choice([None, self.now - timedelta(days=1)]),
+            }
+            with self.subTest(**state):
+                expected = CustomUser(**state)
+                expected.apply_due_refill(self.now)
+                expected_success = expected.credits > 0
+                if expected_success:
+                    expected.credits -= 1
+                    if expected.credits == 0:
+                        expected.last_depleted_time = self.now
+                    if expected.membership == 'PREMIUM':
+                        expected.is_thread_depth_locked = False
+                    else:
+                        expected.last_usage_timestamp = self.now
+
+                user = self.make_user(**state)
+                success, remaining = user.debit_credit(self.now)
+                self.assertEqual(success, expected_success)
+                row = CustomUser.objects.values(*DEBIT_FIELDS).get(pk=user.pk)
+                if success:
+                    self.assertEqual(remaining, expected.credits)
+                    self.assertEqual(row, {name: getattr(expected, name) for name in DEBIT_FIELDS})
+                else:
+                    self.assertEqual(row, {name: state[name] for name in DEBIT_FIELDS})
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs row-level locking")
+class ConcurrentDebitTests(TransactionTestCase):
+    def test_parallel_debits_never_overspend(self):
+        user = CustomUser.objects.create_user(clerk_user_id='user_debit_concurrent')
+        CustomUser.objects.filter(pk=user.pk).update(credits=5)
+        results = []
+        barrier = threading.Barrier(10)
+
+        def debit():
+            try:
+                instance = CustomUser.objects.get(pk=user.pk)
+                barrier.wait()
+                results.append(instance.debit_credit()[0])
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=debit) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 5)
+        user.refresh_from_db()
+        self.assertEqual(user.credits, 0)
+        self.assertIsNotNone(user.last_depleted_time)
+
+
+def make_conversations(user, count, messages=5):
+    conversations = Conversation.objects.bulk_create(
+        Conversation(user=user, title=f'conversation {index}') for index in range(count)
+    )
+    Message.objects.bulk_create(
+        Message(conversation=conversation, sender='user', input_type='text', type='chat', text_content=f'message {index}')
+        for conversation in conversations
+        for index in range(messages)
+    )
+    # Favorite every other conversation so both branches of is_favorite are serialized
+    FavoriteConversation.objects.bulk_create(
+        FavoriteConversation(user=user, conversation=conversation) for conversation in conversations[::2]
+    )
+    return conversations
+
+
+class ConversationQueryCountTests(TestCase):
+    """Listing and retrieving conversations must not run a query per conversation, message or favorite."""
+
+    def get(self, user, action, **kwargs):
+        request = APIRequestFactory().get('/api/conversations/')
+        request.user = user
+        force_authenticate(request, user=user)
+        response = ConversationListCreateView.as_view({'get': action})(request, **kwargs)
+        response.render()
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return response
+
+    def assertConstantQueries(self, action, expected):
+        for size in (1, 20):
+            user = CustomUser.objects.create_user(clerk_user_id=f'user_query_counts_{action}_{size}')
+            conversations = make_conversations(user, size)
+            kwargs = {'uuid': conversations[0].uuid} if action == 'retrieve' else {}
+            with self.subTest(conversations=size), self.assertNumQueries(expected):
+                self.get(user, action, **kwargs)
+
+    def test_list(self):
+        self.assertConstantQueries('list', 2)
+
+    @override_settings(API_READ_PROJECTIONS=False)
+    def test_list_with_serializers(self):
+        self.assertConstantQueries('list', 2)
+
+    def test_retrieve(self):
+        self.assertConstantQueries('retrieve', 2)
+
+
+def make_parity_messages(conversation, count):
+    rows = []
+    for index in range(count):
+        kind = index % 5
+        rows.append(Message(
+            conversation=conversation,
+            sender='user' if index % 2 else 'ai',
+            input_type=('text', 'text', 'image_upload', 'json', 'social_link_upload')[kind],
+            type=('chat', 'booking', 'chat', 'companion_cards', 'payment_response')[kind],
+            # Non-ASCII, U+2028, empty and null text
+            text_content=(f'message {index} \u2014 caf\u00e9 \u2028', f'booking {index}', '', None, 'link')[kind],
+            image=f'chat_images/photo-{index}.jpg' if kind == 2 else None,
+            search_results=[{'id': index, 'name': 'Guide', 'price': 45.5, 'tags': ['food']}] if kind == 3 else None,
+            total_amount=Decimal('129.9') if kind == 1 else (Decimal('0') if kind == 4 else None),
+            currency='USD' if kind == 1 else None,
+            payment_status='paid' if kind == 4 else None,
+            companion_id=index if kind == 1 else None,
+            booking_date=date(2026, 11, 3) if kind == 1 else None,
+            booking_time=clock(19, 30, 15, 250) if kind == 1 else None,
+        ))
+    Message.objects.bulk_create(rows)
+
+
+class ProjectionParityTests(TestCase):
+    """The .values() projections must render byte-identical JSON to the serializers they replace."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(clerk_user_id='user_projection_parity')
+        cls.conversations = []
+        for index in range(12):
+            conversation = Conversation.objects.create(user=cls.user, title=f'Trip {index} \u2708')
+            make_parity_messages(conversation, index * 3)  # including one with no messages
+            conversation.add_messages(list(conversation.messages.all()))
+            cls.conversations.append(conversation)
+        FavoriteConversation.objects.bulk_create(
+            FavoriteConversation(user=cls.user, conversation=conversation) for conversation in cls.conversations[::3]
+        )
+
+        vault = Vault.objects.create(name='parity')
+        for index in range(8):
+            provider = Provider.objects.create(
+                user=cls.user, vault=vault, name=f'Provider {index}', bio=None if index % 3 else 'Guide \u2713',
+                icon_url=f'https://example.com/{index}.png' if index % 2 else None,
+                is_promoted=index % 4 != 3, completion_count=index,
+            )
+            ServiceOffering.objects.bulk_create(
+                ServiceOffering(provider=provider, service_title=f'Tour {n}', description=None if n else 'Six stops')
+                for n in range(index % 3)
+            )
+
+    def setUp(self):
+        self.request = APIRequestFactory().get('/api/conversations/')
+
+    def assertSameJSON(self, serialized, projected):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(serialized), renderer.render(projected))
+
+    def test_messages(self):
+        messages = Message.objects.filter(conversation__user=self.user)
+        self.assertSameJSON(
+            MessageSerializer(messages, many=True, context={'request': self.request}).data,
+            message_projection.represent(message_projection.values(messages), self.request),
+        )
+
+    def test_messages_without_request(self):
+        messages = Message.objects.filter(conversation__user=self.user)
+        self.assertSameJSON(
+            MessageSerializer(messages, many=True).data,
+            message_projection.represent(message_projection.values(messages)),
+        )
+
+    def test_messages_in_another_timezone(self):
+        messages = Message.objects.filter(conversation__user=self.user)
+        with timezone.override('Asia/Tokyo'):
+            self.assertSameJSON(
+                MessageSerializer(messages, many=True).data,
+                message_projection.represent(message_projection.values(messages)),
+            )
+
+    def test_conversations(self):
+        favorites = FavoriteConversation.objects.filter(user=self.user, conversation=OuterRef('pk'))
+        conversations = Conversation.objects.filter(user=self.user).annotate(is_favorite=Exists(favorites))
+        self.assertSameJSON(
+            ConversationSerializer(
+                conversations.prefetch_related('messages'), many=True, context={'request': self.request}
+            ).data,
+            conversation_projection.represent(conversation_projection.values(conversations), self.request),
+        )
+
+    def test_promoted_providers(self):
+        providers = Provider.objects.filter(is_promoted=True)
+        self.assertSameJSON(
+            ProviderWithOfferingsSerializer(providers.prefetch_related('offerings'), many=True).data,
+            provider_projection.represent(provider_projection.values(providers)),
+        )
+
+    def test_endpoints(self):
+        cases = [
+            (ConversationListCreateView, 'list', '/api/conversations/?limit=5', {}),
+            (ConversationListCreateView, 'messages', '/api/conversations/x/messages/?limit=10',
+             {'uuid': self.conversations[-1].uuid}),
+            (ProviderViewSet, 'promoted_providers', '/api/providers/promoted_providers/', {}),
+        ]
+        for viewset, action, url, kwargs in cases:
+            bodies = []
+            for enabled in (False, True):
+                with override_settings(API_READ_PROJECTIONS=enabled):
+                    request = APIRequestFactory().get(url)
+                    request.user = self.user
+                    force_authenticate(request, user=self.user)
+                    response = viewset.as_view({'get': action})(request, **kwargs)
+                    response.render()
+                    bodies.append((response.status_code, response.content, response.get('Link')))
+            with self.subTest(action=action):
+                self.assertEqual(bodies[0], bodies[1])
+
+
+class SyncWatermarkTests(TestCase):
+    """A message whose lower id commits after a higher one was synced must still be delivered."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(clerk_user_id='user_sync_watermark')
+        self.conversation, self.elsewhere = make_conversations(self.user, 2, messages=0)
+
+    def sync(self, watermark):
+        delta = build_delta(Conversation.objects.filter(pk=self.conversation.pk), watermark, 50)
+        message_ids = [message['id'] for data in delta['conversations'] for message in data['messages']]
+        return message_ids, Watermark.decode(delta['watermark'])
+
+    def add_message(self, conversation):
+        return Message.objects.create(
+            conversation=conversation, sender='user', input_type='text', type='chat', text_content='hello',
+        )
+
+    def test_late_commit_is_resent(self):
+        # The in-flight message is "uncommitted" while it sits in another conversation
+        in_flight = self.add_message(self.elsewhere)
+        synced = self.add_message(self.conversation)
+        message_ids, watermark = self.sync(Watermark())
+        self.assertEqual(message_ids, [synced.id])
+
+        Message.objects.filter(pk=in_flight.pk).update(conversation=self.conversation)
+        message_ids, watermark = self.sync(watermark)
+        self.assertEqual(message_ids, [in_flight.id, synced.id])
+
+    def test_settled_messages_are_not_resent(self):
+        old = self.add_message(self.conversation)
+        Message.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        recent = self.add_message(self.conversation)
+
+        message_ids, watermark = self.sync(Watermark())
+        self.assertEqual(message_ids, [old.id, recent.id])
+        self.assertEqual((watermark.settled_id, watermark.message_id), (old.id, recent.id))
+        message_ids, watermark = self.sync(watermark)
+        self.assertEqual(message_ids, [recent.id])
+
+        with override_settings(CONVERSATION_SYNC_OVERLAP=0):
+            _, watermark = self.sync(watermark)  # resends recent one last time and settles it
+            message_ids, watermark = self.sync(watermark)
+        self.assertEqual(message_ids, [])
+
+    def test_three_field_tokens_still_decode(self):
+        token = Watermark(None, 7, None).encode()
+        legacy = base64.urlsafe_b64encode(json.dumps([None, 7, None]).encode()).decode().rstrip('=')
+        self.assertEqual(vars(Watermark.decode(legacy)), vars(Watermark.decode(token)))
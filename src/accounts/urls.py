@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import ConversationListCreateView, AnalysisViewSet, ChatViewSet, credit_usage_history, ProviderViewSet
+from .views import ConversationListCreateView, AnalysisViewSet, ChatViewSet, credit_usage_history, credit_usage_summary, ProviderViewSet
 
 # Create a router
 router = DefaultRouter()
@@ -15,4 +15,5 @@ urlpatterns = [
     path('credits/status/', AnalysisViewSet.as_view({'get': 'status'}), name='credits-status'),
     path('history/', ConversationListCreateView.as_view({'get': 'history'}), name='history'),
     path('credits/history/', credit_usage_history, name='credit-usage-history'),
+    path('credits/summary/', credit_usage_summary, name='credit-usage-summary'),
 ] + router.urls
\ No newline at end of file
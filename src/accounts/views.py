@@ -1,8 +1,14 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
-from .models import Conversation, Message, FavoriteConversation, CreditUsageHistory, Provider, ServiceOffering
-from .serializers import ConversationSerializer, MessageSerializer, FavoriteConversationSerializer, ProviderSerializer, ServiceOfferingSerializer, ProviderWithOfferingsSerializer
+from rest_framework.exceptions import ValidationError
+from .models import Conversation, Message, FavoriteConversation, CreditUsageHistory, DailyCreditUsage, Provider, ServiceOffering
+from .export import export_stream
+from .pagination import KeysetPaginator
+from .projections import conversation_projection, message_projection, projections_enabled, provider_projection
+from .search import search_conversations
+from .sync import Watermark, build_delta
+from .serializers import ConversationSerializer, ConversationDetailSerializer, ConversationSyncSerializer, MessageSerializer, MessageInputSerializer, FavoriteConversationSerializer, ProviderSerializer, ServiceOfferingSerializer, ProviderWithOfferingsSerializer
 from helpers.myclerk.auth import ClerkAuthentication
 from helpers.myclerk.decorators import api_login_required
 from django.utils.decorators import method_decorator
@@ -10,14 +16,18 @@ from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
-from datetime import datetime
-from django.http import Http404
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.db.models import Exists, OuterRef, Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 
 from cfehome.views import send_error_email
 import json
 from openai import OpenAI
 from helpers.vision.ocr import analyze_image_with_crop, extract_text_blocks_from_image
 from helpers._mixpanel.client import mixpanel_client
+from .credits import credit_hold_required, get_credit_status, insufficient_credits_response
 import logging
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics
@@ -32,7 +42,70 @@ class ConversationListCreateView(viewsets.ModelViewSet):
     lookup_field = 'uuid'  # Add this line to use uuid instead of id
 
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user)
+        queryset = Conversation.objects.filter(user=self.request.user)
+        if self.action in ('list', 'retrieve', 'sync', 'sync_conversation'):
+            queryset = self.with_favorite(queryset)
+        return queryset
+
+    def with_favorite(self, queryset):
+        """Annotate is_favorite so neither the serializer nor the projection queries it per row."""
+        favorites = FavoriteConversation.objects.filter(user=self.request.user, conversation=OuterRef('pk'))
+        return queryset.annotate(is_favorite=Exists(favorites))
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return ConversationDetailSerializer
+        return super().get_serializer_class()
+
+    def get_paginator(self, page_size):
+        # Newest first; see KeysetPaginator for the cursor
+        return KeysetPaginator(
+            ordering=('-created_at', '-id'),
+            page_size=page_size,
+            max_page_size=getattr(settings, 'CONVERSATION_MAX_PAGE_SIZE', 200),
+        )
+
+    def list(self, request, *args, **kwargs):
+        paginator = self.get_paginator(getattr(settings, 'CONVERSATION_PAGE_SIZE', 20))
+        queryset = self.filter_queryset(self.get_queryset())
+        if projections_enabled():
+            rows, _ = paginator.paginate(conversation_projection.values(queryset), request)
+            return paginator.get_paginated_response(conversation_projection.represent(rows, request))
+        conversations, _ = paginator.paginate(queryset.prefetch_related('messages'), request)
+        serializer = self.get_serializer(conversations, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def get_message_paginator(self):
+        # Newest first, so the first page is the latest messages and "next" pages go back in time
+        return KeysetPaginator(
+            ordering=('-created_at', '-id'),
+            page_size=getattr(settings, 'CONVERSATION_MESSAGES_PAGE_SIZE', 50),
+            max_page_size=getattr(settings, 'CONVERSATION_MAX_PAGE_SIZE', 200),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        conversation = self.get_object()
+        paginator = self.get_message_paginator()
+        messages, conversation.messages_cursor = paginator.paginate(conversation.messages.all(), request)
+        conversation.latest_messages = messages[::-1]  # oldest first, as before
+        serializer = self.get_serializer(conversation)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def messages(self, request, uuid=None):
+        """
+        One page of a conversation's messages, oldest first within the page.
+        Without a cursor this is the latest page; the ``next`` cursor goes
+        back to older messages and ``prev`` forward to newer ones.
+        """
+        conversation = self.get_object()
+        paginator = self.get_message_paginator()
+        if projections_enabled():
+            rows, _ = paginator.paginate(message_projection.values(conversation.messages.all()), request)
+            return paginator.get_paginated_response(message_projection.represent(rows[::-1], request))
+        messages, _ = paginator.paginate(conversation.messages.all(), request)
+        serializer = MessageSerializer(messages[::-1], many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
     def get_object(self):
         # Get the uuid from the URL
@@ -52,6 +125,11 @@ class ConversationListCreateView(viewsets.ModelViewSet):
         title = request.data.get('title')
         messages_data = request.data.get('messages', [])
 
+        # Validate every message before writing anything
+        message_serializer = MessageInputSerializer(data=messages_data, many=True)
+        if not message_serializer.is_valid():
+            return Response({'messages': message_serializer.errors}, status=400)
+
         try:
             with transaction.atomic():
                 conversation = Conversation.objects.create(
@@ -73,22 +151,20 @@ class ConversationListCreateView(viewsets.ModelViewSet):
                     }
                 )
 
-                messages = []
-                for msg_data in messages_data:
-                    message = Message.objects.create(
-                        conversation=conversation,
-                        sender=msg_data.get('sender'),
-                        input_type=msg_data.get('input_type', 'text'),
-                        type=msg_data.get('type'),
-                        text_content=msg_data.get('text_content', ''),
-                        image=msg_data.get('image'),
-                        builder_data=msg_data.get('builder_data'),
-                    )
-                    messages.append(message)
+                messages = message_serializer.save(conversation=conversation)
+                conversation.add_messages(messages)
 
+                # Nothing else can write to a conversation before it exists,
+                # so every id up to these is already settled
+                watermark = Watermark(
+                    str(conversation.uuid),
+                    max((message.id for message in messages), default=0),
+                    conversation.updated_at,
+                )
                 response_data = {
-                    'conversation': ConversationSerializer(conversation).data,
-                    'messages': MessageSerializer(messages, many=True).data
+                    'conversation': ConversationSyncSerializer(conversation).data,
+                    'messages': MessageSerializer(messages, many=True).data,
+                    'watermark': watermark.encode(),
                 }
                 return Response(response_data, status=status.HTTP_201_CREATED)
 
@@ -98,63 +174,120 @@ class ConversationListCreateView(viewsets.ModelViewSet):
         
     @action(detail=True, methods=['put', 'patch'])
     def batch_update(self, request, uuid=None):
+        """
+        Apply a title and/or new messages, and answer with the sync delta since
+        the client's ``watermark`` (or, without one, since just before this write).
+        """
+        message_serializer = None
+        if 'messages' in request.data:
+            # Validate every message before writing anything
+            message_serializer = MessageInputSerializer(data=request.data['messages'], many=True)
+            if not message_serializer.is_valid():
+                return Response({'messages': message_serializer.errors}, status=400)
 
         try:
             with transaction.atomic():
                 # Get the existing conversation
                 conversation = self.get_queryset().get(uuid=uuid)
-                
+                token = request.data.get('watermark')
+                if token:
+                    since = Watermark.decode(token, scope=str(conversation.uuid))
+                else:
+                    since = Watermark.current(conversation)
+
                 # Update conversation title if provided
                 if 'title' in request.data:
                     conversation.title = request.data['title']
-                    conversation.save()
 
-                if 'messages' in request.data:
+                if message_serializer is not None:
                     # Optionally: don't delete all messages, just add new ones
-                    for msg_data in request.data['messages']:
-                        Message.objects.create(
-                            conversation=conversation,
-                            sender=msg_data.get('sender'),
-                            input_type=msg_data.get('input_type', 'text'),
-                            text_content=msg_data.get('text_content', ''),
-                            type=msg_data.get('type'),
-                            total_amount=msg_data.get('total_amount'),
-                            currency=msg_data.get('currency'),
-                            payment_status=msg_data.get('payment_status'),
-                            companion_id=msg_data.get('companion_id'),
-                            booking_date=msg_data.get('booking_date'),
-                            booking_time=msg_data.get('booking_time'),
-                        )
+                    messages = message_serializer.save(conversation=conversation)
+                    conversation.add_messages(messages)
+
+                # Touch updated_at (and save the title) once for the whole batch
+                conversation.save(update_fields=['title', 'updated_at'])
 
-                # Return the updated conversation with all its related data
-                serializer = self.get_serializer(conversation)
-                return Response(serializer.data)
+                # Return only what changed, not the whole conversation
+                conversations = self.with_favorite(self.get_queryset().filter(pk=conversation.pk))
+                return Response(build_delta(conversations, since, self.get_sync_limit()))
 
         except Conversation.DoesNotExist:
             return Response(
                 {'detail': 'Conversation not found'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except ValidationError:
+            raise
         except Exception as e:
             send_error_email(request, "BATCH_OPERATION_ERROR", str(e))  # Add this
             return Response({'error': str(e)}, status=400)
         
     @action(detail=False, methods=['get'])
     def history(self, request):
-        conversations = (
-            self.get_queryset()
-            .order_by('-created_at')
-            .values('uuid', 'title', 'created_at')
+        paginator = self.get_paginator(getattr(settings, 'CONVERSATION_HISTORY_PAGE_SIZE', 50))
+        conversations, _ = paginator.paginate(
+            self.get_queryset().values(
+                'id', 'uuid', 'title', 'created_at',
+                'message_count', 'last_message_at', 'last_message_preview', 'last_message_type',
+            ),
+            request,
         )
         data = [
             {
                 'id': str(conv['uuid']),
                 'title': conv['title'],
-                'date': conv['created_at'].isoformat()
+                'date': conv['created_at'].isoformat(),
+                'message_count': conv['message_count'],
+                'last_message_at': conv['last_message_at'].isoformat() if conv['last_message_at'] else None,
+                'last_message_preview': conv['last_message_preview'],
+                'last_message_type': conv['last_message_type'],
             }
             for conv in conversations
         ]
-        return Response(data)
+        return paginator.get_paginated_response(data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked, highlighted matches in the user's messages and titles, grouped by conversation."""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=400)
+        try:
+            limit = int(request.query_params.get('limit', getattr(settings, 'CONVERSATION_SEARCH_LIMIT', 50)))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        limit = max(1, min(limit, getattr(settings, 'CONVERSATION_MAX_PAGE_SIZE', 200)))
+        return Response({'query': query, 'results': search_conversations(request.user, query, limit)})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every conversation and message as NDJSON; ``?compress=gzip`` for a .ndjson.gz file."""
+        compress = request.query_params.get('compress') == 'gzip'
+        filename = f"conversations-{timezone.now():%Y%m%d}.ndjson" + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            export_stream(request.user, compress=compress),
+            content_type='application/gzip' if compress else 'application/x-ndjson',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+    def get_sync_limit(self):
+        return getattr(settings, 'CONVERSATION_SYNC_LIMIT', 500)
+
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """Everything that changed in the user's conversations since ``?watermark=``."""
+        watermark = Watermark.decode(request.query_params.get('watermark'))
+        return Response(build_delta(self.get_queryset(), watermark, self.get_sync_limit()))
+
+    @action(detail=True, methods=['get'], url_path='sync')
+    def sync_conversation(self, request, uuid=None):
+        """What changed in one conversation since ``?watermark=``."""
+        conversation = self.get_object()
+        watermark = Watermark.decode(request.query_params.get('watermark'), scope=str(conversation.uuid))
+        conversations = self.get_queryset().filter(pk=conversation.pk)
+        return Response(build_delta(conversations, watermark, self.get_sync_limit()))
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -164,18 +297,9 @@ class ConversationListCreateView(viewsets.ModelViewSet):
 @method_decorator(api_login_required, name='dispatch')
 class AnalysisViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
+    @credit_hold_required
     def analyze(self, request):
-        # Check credits
-        if not request.user.credits > 0:
-            next_refill = request.user.get_daily_refill_time()
-            return Response({
-                'error': 'Insufficient credits',
-                'remaining_credits': request.user.credits,
-                'next_refill': next_refill,
-                'is_thread_locked': request.user.is_thread_depth_locked,
-            }, status=402)
-
-        # Check thread depth lock
+        # Check thread depth lock (the credit is already held by credit_hold_required)
         if request.user.is_thread_depth_locked:
             return Response({
                 'error': 'Thread depth limit reached',
@@ -296,12 +420,13 @@ class AnalysisViewSet(viewsets.ViewSet):
                     )
 
             # Deduct credit
-            request.user.use_credit(
+            if not request.credit_hold.commit(
                 event_type="deepfeel_hit",
                 cost=1,
                 kind="Monthly Credits",
                 model_name="gpt-4.1"
-            )
+            ):
+                return insufficient_credits_response(request.user)
             
             # Return the analysis data directly
             return Response(analysis_data)
@@ -316,47 +441,22 @@ class AnalysisViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def status(self, request):
-        user = request.user
-        user.check_and_refill_credits()
-        
-        reset_time = user.get_daily_refill_time()
-        reset_time_iso = reset_time.isoformat() if reset_time else None
-        
-        now = timezone.now()
-        days_until_refill = (reset_time - now).days if reset_time else None
-        
-        is_free_user = user.membership == 'FREE'
-        
-        return Response({
-            'remaining_credits': user.credits,
-            'reset_time': reset_time_iso,
-            'is_out_of_credits': user.credits <= 0,
-            'plan_type': user.membership,
-            'total_credits': 200 if user.membership == 'PREMIUM' else 10,
-            'total_usage_14d': user.total_usage_14d if is_free_user else 0,
-            'is_thread_locked': user.is_thread_depth_locked if is_free_user else False,
-            'days_until_refill': days_until_refill,
-            'needs_extended_refresh': is_free_user and user.total_usage_14d >= 140,
-            'is_extended_refresh': user.is_thread_depth_locked,
-            'last_usage': user.last_usage_timestamp.isoformat() if user.last_usage_timestamp else None,
-            'usage_limit': 140 if is_free_user else None,
-            'daily_limit': 200 if user.membership == 'PREMIUM' else 10,
-        })
+        # Cached per user and invalidated by debits, purchases and refills
+        payload, etag = get_credit_status(request.user)
+        etag = quote_etag(etag)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
     @action(detail=False, methods=['post'])
+    @credit_hold_required
     def analyze_image(self, request):
         logger.info("DEBUG: Entered analyze_image view")  # Debug log
 
-        # Check credits
-        if not request.user.credits > 0:
-            next_refill = request.user.get_daily_refill_time()
-            return Response({
-                'error': 'Insufficient credits',
-                'remaining_credits': request.user.credits,
-                'next_refill': next_refill,
-                'is_thread_locked': request.user.is_thread_depth_locked,
-            }, status=402)
-
         # Get image from request
         image_file = request.FILES.get('image')
         if not image_file:
@@ -365,12 +465,13 @@ class AnalysisViewSet(viewsets.ViewSet):
         try:
             blocks = analyze_image_with_crop(image_file)
             # Deduct credit
-            request.user.use_credit(
+            if not request.credit_hold.commit(
                 event_type="image_upload",
                 cost=1,
                 kind="Monthly Credits",
                 model_name="google-vision"
-            )
+            ):
+                return insufficient_credits_response(request.user)
 
             mixpanel_client.track_api_event(
                 user_id=str(request.user.clerk_user_id),
@@ -394,18 +495,9 @@ class AnalysisViewSet(viewsets.ViewSet):
 @method_decorator(api_login_required, name='dispatch')
 class ChatViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
+    @credit_hold_required
     def initial_send(self, request):
         
-        # Check credits
-        if not request.user.credits > 0:
-            next_refill = request.user.get_daily_refill_time()
-            return Response({
-                'error': 'Insufficient credits',
-                'remaining_credits': request.user.credits,
-                'next_refill': next_refill,
-                'is_thread_locked': request.user.is_thread_depth_locked,
-            }, status=402)
-
         # Get data from request
         conversation_uuid = request.data.get('conversation_uuid')
         message_content = request.data.get('message')
@@ -457,6 +549,9 @@ class ChatViewSet(viewsets.ViewSet):
                         text_content=message_content,
                         type='chat'
                     )
+                    # Recorded on the conversation once, right before commit, so
+                    # its row isn't locked for the whole OpenAI call
+                    created_messages = [user_message]
                     logger.info(f"DEBUG: ✅ Created user message: {user_message.id}")
                 except Exception as e:
                     logger.error(f"DEBUG: ❌ Failed to create user message: {e}")
@@ -601,18 +696,22 @@ Remember: You're helping travelers find the perfect local companion. Be warm, en
                             text_content=ai_response.content,
                             type='chat'
                         )
+                        created_messages.append(ai_message)
                         logger.info(f"DEBUG: ✅ Created AI message: {ai_message.id}")
                 except Exception as e:
                     logger.error(f"DEBUG: ❌ Failed to create AI message: {e}")
                     raise
 
                 # Deduct credit
-                request.user.use_credit(
+                if not request.credit_hold.commit(
                     event_type="chat",
                     cost=1,
                     kind="Monthly Credits",
                     model_name="gpt-4o"
-                )
+                ):
+                    # Don't keep the messages of a reply the user didn't pay for
+                    transaction.set_rollback(True)
+                    return insufficient_credits_response(request.user)
 
                 # Prepare response data
                 response_data = {
@@ -644,6 +743,7 @@ Remember: You're helping travelers find the perfect local companion. Be warm, en
                             type='companion_cards',
                             search_results=search_results
                         )
+                        created_messages.append(companion_cards_message)
                         logger.info(f"DEBUG: ✅ Created companion_cards message: {companion_cards_message.id}")
                         
                         response_data['search_parameters'] = search_params
@@ -688,6 +788,8 @@ Remember: You're helping travelers find the perfect local companion. Be warm, en
                 )
                 logger.info(f"DEBUG: ✅ Analytics tracked")
 
+                conversation.add_messages(created_messages)
+
                 logger.info(f"DEBUG: === RETURNING RESPONSE ===")
                 logger.info(f"DEBUG: Response data keys: {list(response_data.keys())}")
                 return Response(response_data)
@@ -793,18 +895,64 @@ Remember: You're helping travelers find the perfect local companion. Be warm, en
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def credit_usage_history(request):
-    history = CreditUsageHistory.objects.filter(user=request.user)
+    # One page per request, newest first; see KeysetPaginator for the cursor
+    paginator = KeysetPaginator(ordering=('-date', '-id'))
+    history, _ = paginator.paginate(
+        CreditUsageHistory.objects.filter(user=request.user)
+        .values('id', 'event_type', 'cost', 'date', 'kind', 'model'),
+        request,
+    )
     data = [
         {
-            "event_type": h.event_type,
-            "cost": str(h.cost),
-            "date": h.date.strftime("%B %d, %Y"),
-            "kind": h.kind,
-            "model": h.model,
+            "event_type": h['event_type'],
+            "cost": str(h['cost']),
+            "date": h['date'].strftime("%B %d, %Y"),
+            "kind": h['kind'],
+            "model": h['model'],
         }
         for h in history
     ]
-    return Response(data)
+    return paginator.get_paginated_response(data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def credit_usage_summary(request):
+    """Credit usage over the last ``days`` days (default 30), answered from DailyCreditUsage."""
+    try:
+        days = min(max(int(request.query_params.get('days', 30)), 1), 366)
+    except ValueError:
+        return Response({'error': 'days must be an integer'}, status=400)
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rollups = DailyCreditUsage.objects.filter(user=request.user, day__gte=since)
+
+    by_day = rollups.values('day').annotate(count=Sum('count'), cost=Sum('cost')).order_by('day')
+    by_event = (
+        rollups.values('event_type', 'kind', 'model')
+        .annotate(count=Sum('count'), cost=Sum('cost'))
+        .order_by('-count')
+    )
+    total_count = sum(row['count'] for row in by_day)
+    total_cost = sum((row['cost'] for row in by_day), Decimal(0))
+    return Response({
+        'days': days,
+        'since': since.isoformat(),
+        'total_count': total_count,
+        'total_cost': str(total_cost),
+        'by_day': [
+            {'date': row['day'].isoformat(), 'count': row['count'], 'cost': str(row['cost'])}
+            for row in by_day
+        ],
+        'by_event': [
+            {
+                'event_type': row['event_type'],
+                'kind': row['kind'],
+                'model': row['model'] or None,
+                'count': row['count'],
+                'cost': str(row['cost']),
+            }
+            for row in by_event
+        ],
+    })
 
 @method_decorator(api_login_required, name='dispatch')
 class ProviderViewSet(viewsets.ViewSet):
@@ -855,5 +1003,7 @@ class ProviderViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def promoted_providers(self, request):
         providers = Provider.objects.filter(is_promoted=True)
-        serializer = ProviderWithOfferingsSerializer(providers, many=True)
+        if projections_enabled():
+            return Response(provider_projection.represent(provider_projection.values(providers)))
+        serializer = ProviderWithOfferingsSerializer(providers.prefetch_related('offerings'), many=True)
         return Response(serializer.data)
@@ -99,6 +99,19 @@ CLERK_AUTH_PARTIES = [
     'https://api.0052.live',
 ]
 
+# Session tokens are verified locally against Clerk's JWKS (cached in-process).
+# Leave CLERK_JWKS_URL empty to verify against CLERK_JWT_PUBLIC_KEY only.
+CLERK_JWKS_URL = config("CLERK_JWKS_URL", default="https://api.clerk.com/v1/jwks")
+CLERK_JWKS_REFRESH_INTERVAL = config("CLERK_JWKS_REFRESH_INTERVAL", default=3600, cast=int)  # seconds
+CLERK_JWT_LEEWAY = config("CLERK_JWT_LEEWAY", default=5, cast=int)  # seconds of clock skew
+CLERK_REJECTED_TOKEN_CACHE_SIZE = 10000  # rejected token digests remembered per process
+CLERK_REJECTED_TOKEN_TTL = 60 * 60  # upper bound on how long a rejection is remembered
+
+# Clerk identity cache (clerk_user_id -> user pk + claims hash): in-process LRU in front of Redis
+CLERK_IDENTITY_CACHE_TTL = 60 * 60 * 24
+CLERK_IDENTITY_LOCAL_TTL = 60
+CLERK_IDENTITY_LOCAL_SIZE = 10000
+
 FRONTEND_URL=config("FRONTEND_URL")
 
 # Mixpanel Configuration
@@ -138,6 +151,16 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'helpers.myclerk.auth.ClerkAuthentication',
     ),
+    # orjson-backed when it is installed, otherwise identical to DRF's stdlib JSON (helpers/fastjson)
+    'DEFAULT_RENDERER_CLASSES': (
+        'helpers.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'helpers.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 MIDDLEWARE = [
@@ -300,6 +323,48 @@ CACHES = {
     }
 }
 
+# Credit engine: "db" debits accounts_customuser directly; "redis" keeps balances
+# in Redis (accounts/credits/ledger.py) and needs `manage.py flush_credit_ledger`
+# running to write them back.
+CREDIT_ENGINE = config('CREDIT_ENGINE', default='db')
+CREDIT_LEDGER_FLUSH_INTERVAL = config('CREDIT_LEDGER_FLUSH_INTERVAL', default=2.0, cast=float)  # seconds
+CREDIT_LEDGER_FLUSH_BATCH = 500
+CREDIT_LEDGER_CLAIM_TIMEOUT = 300  # seconds before a dead flusher's claimed users are requeued
+
+# Credit usage history (db engine): "immediate" inserts a row per debit; "buffered"
+# batches rows per worker (accounts/credits/history.py) and bulk inserts them.
+CREDIT_HISTORY_MODE = config('CREDIT_HISTORY_MODE', default='immediate')
+CREDIT_HISTORY_BUFFER_SIZE = config('CREDIT_HISTORY_BUFFER_SIZE', default=100, cast=int)
+CREDIT_HISTORY_FLUSH_INTERVAL = config('CREDIT_HISTORY_FLUSH_INTERVAL', default=5.0, cast=float)  # seconds
+CREDIT_HISTORY_ORDERED = config('CREDIT_HISTORY_ORDERED', default=True, cast=bool)  # write batches in debit order
+CREDIT_HISTORY_MAX_PENDING = 10000  # rows kept for retry when flushes fail
+
+# Credit holds taken before slow AI calls (accounts/credits/holds.py); a hold left by a
+# request that died stops counting after this many seconds.
+CREDIT_HOLD_TTL = config('CREDIT_HOLD_TTL', default=120, cast=int)
+CREDIT_HOLD_RETRY_AFTER = 30  # seconds to skip Redis for holds after it failed
+
+# Upper bound on how long a cached credits/status/ payload lives (seconds); writes
+# invalidate it sooner (accounts/credits/status.py).
+CREDIT_STATUS_CACHE_TTL = 300
+
+# Default page sizes for the conversation list (full messages), history sidebar and a
+# conversation's messages; clients can ask for up to CONVERSATION_MAX_PAGE_SIZE with ?limit=.
+CONVERSATION_PAGE_SIZE = config('CONVERSATION_PAGE_SIZE', default=20, cast=int)
+CONVERSATION_HISTORY_PAGE_SIZE = config('CONVERSATION_HISTORY_PAGE_SIZE', default=50, cast=int)
+CONVERSATION_MESSAGES_PAGE_SIZE = config('CONVERSATION_MESSAGES_PAGE_SIZE', default=50, cast=int)
+CONVERSATION_MAX_PAGE_SIZE = 200
+CONVERSATION_SEARCH_LIMIT = 50  # matching messages per search response
+CONVERSATION_SYNC_LIMIT = 500  # messages per sync response; has_more asks the client to call again
+# Seconds a message-inserting transaction may stay open (a send spans the AI
+# call). Sync re-sends messages this recent, so one that commits after a
+# higher id was synced is still delivered; clients dedupe by id.
+CONVERSATION_SYNC_OVERLAP = 300
+# Build conversation, message and provider list responses straight from .values() rows
+# instead of the serializers (accounts/projections.py); the output is identical.
+API_READ_PROJECTIONS = config('API_READ_PROJECTIONS', default=True, cast=bool)
+EXPORT_CHUNK_SIZE = 2000  # rows fetched per round trip by the streaming export (accounts/export.py)
+
 # Use Redis for session storage
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
@@ -358,7 +423,8 @@ CORS_ALLOW_METHODS = [
     'PUT',
 ]
 
-CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken']
+# Keyset-paginated lists (accounts/pagination.py) send their cursors in these headers
+CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken', 'Link', 'X-Next-Cursor', 'X-Previous-Cursor']
 CORS_PREFLIGHT_MAX_AGE = 86400  # 24 hours
 
 CSRF_TRUSTED_ORIGINS = [
@@ -4,6 +4,7 @@ from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from accounts.models import CustomUser
+from accounts.credits import credit_ledger_write
 import json
 import hmac
 import hashlib
@@ -11,6 +12,7 @@ import time
 
 from clerk_backend_api import Clerk
 from helpers.myclerk.utils import update_or_create_clerk_user
+from helpers.myclerk.identity import invalidate_clerk_identity
 
 import logging
 logger = logging.getLogger('goldmage')
@@ -89,6 +91,7 @@ def stripe_webhook(request):
                     credits_to_add = int(session.metadata['credits'])
                     user.add_credits(credits_to_add)
                     user.save()
+                    invalidate_clerk_identity(user.clerk_user_id)
                     logger.info(f"✅ Added {credits_to_add} credits to user {user.id} (now has {user.credits} credits)")
                     
                     # Track the successful purchase
@@ -110,12 +113,14 @@ def stripe_webhook(request):
             else:
                 try:
                     user = CustomUser.objects.get(clerk_user_id=session.customer)
-                    user.stripe_customer_id = session.customer
-                    # Set premium membership and credits
-                    user.membership = 'PREMIUM'
-                    user.credits = 500  # Set initial premium credits
-                    user.is_thread_depth_locked = False  # Remove any thread locks
-                    user.save()
+                    with credit_ledger_write(user):
+                        user.stripe_customer_id = session.customer
+                        # Set premium membership and credits
+                        user.membership = 'PREMIUM'
+                        user.credits = 500  # Set initial premium credits
+                        user.is_thread_depth_locked = False  # Remove any thread locks
+                        user.save()
+                    invalidate_clerk_identity(user.clerk_user_id)
                     logger.info(f"✅ Premium subscription activated for user {user.id}")
                 except CustomUser.DoesNotExist:
                     logger.warning(f"User not found for subscription: {session.customer}")
@@ -125,9 +130,11 @@ def stripe_webhook(request):
             try:
                 user = CustomUser.objects.get(clerk_user_id=subscription.customer)
                 # Reset to free tier
-                user.membership = 'FREE'
-                user.credits = 10  # Reset to free tier credits
-                user.save()
+                with credit_ledger_write(user):
+                    user.membership = 'FREE'
+                    user.credits = 10  # Reset to free tier credits
+                    user.save()
+                invalidate_clerk_identity(user.clerk_user_id)
             except CustomUser.DoesNotExist:
                 pass
 
@@ -136,11 +143,13 @@ def stripe_webhook(request):
             logger.info(f"New subscription: {event.data.object.id}")
             try:
                 user = CustomUser.objects.get(clerk_user_id=subscription.customer)
-                if subscription.status == 'active':
-                    user.membership = 'PREMIUM'
-                else:
-                    user.membership = 'FREE'
-                user.save()
+                with credit_ledger_write(user):
+                    if subscription.status == 'active':
+                        user.membership = 'PREMIUM'
+                    else:
+                        user.membership = 'FREE'
+                    user.save()
+                invalidate_clerk_identity(user.clerk_user_id)
             except CustomUser.DoesNotExist:
                 pass
 
@@ -149,6 +158,7 @@ def stripe_webhook(request):
             try:
                 user = CustomUser.objects.get(clerk_user_id=customer.id)
                 user.save()
+                invalidate_clerk_identity(user.clerk_user_id)
             except CustomUser.DoesNotExist:
                 pass
 
@@ -159,6 +169,7 @@ def stripe_webhook(request):
                 if user.email != customer.email:
                     user.email = customer.email
                     user.save()
+                    invalidate_clerk_identity(user.clerk_user_id)
             except CustomUser.DoesNotExist:
                 pass
 
@@ -166,8 +177,10 @@ def stripe_webhook(request):
             customer = event.data.object
             try:
                 user = CustomUser.objects.get(clerk_user_id=customer.id)
-                user.membership = 'FREE'
-                user.save()
+                with credit_ledger_write(user):
+                    user.membership = 'FREE'
+                    user.save()
+                invalidate_clerk_identity(user.clerk_user_id)
             except CustomUser.DoesNotExist:
                 pass
 
@@ -188,9 +201,11 @@ def stripe_webhook(request):
                     # If you store Stripe customer ID on your user model, use that
                     user = CustomUser.objects.get(stripe_customer_id=customer_id)
                 # Top up credits for premium renewal
-                user.credits = 500  # or 500, or whatever your monthly premium amount is
-                user.membership = 'PREMIUM'
-                user.save()
+                with credit_ledger_write(user):
+                    user.credits = 500  # or 500, or whatever your monthly premium amount is
+                    user.membership = 'PREMIUM'
+                    user.save()
+                invalidate_clerk_identity(user.clerk_user_id)
                 # Optionally, log or track the renewal
             except CustomUser.DoesNotExist:
                 pass  # Optionally, handle user not found
@@ -0,0 +1,6 @@
+from .backend import fast_json_available
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+
+
+__all__ = ['FastJSONParser', 'FastJSONRenderer', 'fast_json_available']
@@ -0,0 +1,12 @@
+"""
+orjson, when installed. It is optional: without it ``orjson`` is None and
+the renderer and parser behave exactly like DRF's stdlib-json ones.
+"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def fast_json_available():
+    return orjson is not None
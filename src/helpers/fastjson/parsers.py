@@ -0,0 +1,26 @@
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .backend import orjson
+
+
+class FastJSONParser(JSONParser):
+    """
+    ``JSONParser`` on orjson. Bodies orjson rejects are handed to the stdlib
+    parser, so anything it accepts still parses and errors read the same.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        try:
+            if encoding.lower().replace('-', '') != 'utf8':
+                return orjson.loads(body.decode(encoding))
+            return orjson.loads(body)
+        except (orjson.JSONDecodeError, UnicodeDecodeError):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,30 @@
+from rest_framework.renderers import JSONRenderer
+
+from .backend import orjson
+
+if orjson is not None:
+    # Datetimes go through DRF's encoder so they render as DRF does ("Z", not "+00:00")
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` on orjson, producing the same bytes for the compact,
+    unescaped output our settings select. Types orjson doesn't handle
+    natively (Decimal, datetime/date/time, lazy strings, ...) go through
+    DRF's ``JSONEncoder.default``. Pretty-printed output (``; indent=``,
+    the browsable API) and anything orjson rejects fall back to the stdlib.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same JavaScript-safe escaping as JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -2,12 +2,16 @@ from .decorators import (
     api_login_required
 )
 from .utils import (
+    authenticate_clerk_request,
+    get_clerk_claims_from_request,
     get_clerk_user_id_from_request,
     update_or_create_clerk_user
 )
 
 
 __all__ = [
+    'authenticate_clerk_request',
+    'get_clerk_claims_from_request',
     'get_clerk_user_id_from_request',
     'update_or_create_clerk_user',
 ]
\ No newline at end of file
@@ -1,34 +1,27 @@
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-import jwt
-from django.conf import settings
-from django.contrib.auth import get_user_model
 
-User = get_user_model()
+from .utils import authenticate_clerk_request, get_bearer_token
+
 
 class ClerkAuthentication(BaseAuthentication):
+    """
+    DRF authentication backed by the same Clerk pass as ClerkAuthMiddleware.
+
+    The middleware has usually resolved the user already; the result is
+    memoized on the underlying HttpRequest, so this class neither decodes
+    the token nor queries the user table a second time.
+    """
+
     def authenticate(self, request):
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if not auth_header:
+        http_request = request._request
+        if not get_bearer_token(http_request):
             return None
 
-        try:
-            token = auth_header.split(' ')[1]
-            payload = jwt.decode(
-                token,
-                settings.CLERK_JWT_PUBLIC_KEY,
-                algorithms=['RS256'],
-            )
-            
-            clerk_user_id = payload['sub']
-            user, created = User.objects.get_or_create(
-                clerk_user_id=clerk_user_id, 
-                defaults={
-                    'email': payload.get('email'),
-                    'username': payload.get('email')
-                }
-            )
-            
-            return (user, None)
-        except Exception as e:
-            raise AuthenticationFailed(str(e))
\ No newline at end of file
+        user = authenticate_clerk_request(http_request)
+        if user is None:
+            raise AuthenticationFailed('Invalid or expired Clerk session token')
+        return (user, getattr(http_request, 'clerk_claims', None))
+
+    def authenticate_header(self, request):
+        return 'Bearer'
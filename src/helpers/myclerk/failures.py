@@ -0,0 +1,44 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('goldmage')
+
+
+class AuthFailureLog:
+    """
+    Aggregates authentication failures by reason and emits at most one
+    summary line per ``interval`` seconds, instead of a warning (or a
+    traceback) for every rejected request.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._counts = Counter()
+        self._last_detail = None
+        self._last_emit = None
+        self._lock = threading.Lock()
+
+    def record(self, reason, detail=None):
+        now = time.monotonic()
+        with self._lock:
+            self._counts[reason] += 1
+            if detail:
+                self._last_detail = detail
+            if self._last_emit is not None and now - self._last_emit < self.interval:
+                return
+            counts, detail = self._counts, self._last_detail
+            elapsed = now - self._last_emit if self._last_emit is not None else 0
+            self._counts = Counter()
+            self._last_detail = None
+            self._last_emit = now
+
+        summary = ", ".join(f"{name}={count}" for name, count in counts.most_common())
+        message = f"Clerk auth failures in the last {elapsed:.0f}s: {summary}"
+        if detail:
+            message += f" (latest: {detail})"
+        logger.warning(message)
+
+
+auth_failures = AuthFailureLog()
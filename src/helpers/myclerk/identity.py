@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .lru import LRUCache
+
+logger = logging.getLogger('goldmage')
+
+IDENTITY_KEY_PREFIX = 'clerk_identity'
+
+
+# The local tier is short-lived so an invalidation made by another worker
+# (which can only clear Redis and its own LRU) takes effect here quickly.
+local_identities = LRUCache(
+    maxsize=getattr(settings, 'CLERK_IDENTITY_LOCAL_SIZE', 10000),
+    ttl=getattr(settings, 'CLERK_IDENTITY_LOCAL_TTL', 60),
+)
+
+
+def claims_hash(user_data):
+    """Stable digest of the profile fields we copy from the token onto the user."""
+    payload = json.dumps(user_data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _identity_key(clerk_user_id):
+    return f'{IDENTITY_KEY_PREFIX}:{clerk_user_id}'
+
+
+def get_cached_identity(clerk_user_id):
+    """
+    Return ``{'pk': ..., 'hash': ...}`` for a Clerk user, or None.
+
+    Only the primary key and the claims hash are cached; the user row itself
+    is always read fresh, so billing fields on ``request.user`` are never stale.
+    """
+    identity = local_identities.get(clerk_user_id)
+    if identity is not None:
+        return identity
+    try:
+        identity = cache.get(_identity_key(clerk_user_id))
+    except Exception as e:
+        logger.warning(f"Identity cache read failed for {clerk_user_id}: {e}")
+        return None
+    if identity is not None:
+        local_identities.set(clerk_user_id, identity)
+    return identity
+
+
+def set_cached_identity(clerk_user_id, pk, digest):
+    identity = {'pk': pk, 'hash': digest}
+    local_identities.set(clerk_user_id, identity)
+    try:
+        cache.set(
+            _identity_key(clerk_user_id),
+            identity,
+            getattr(settings, 'CLERK_IDENTITY_CACHE_TTL', 60 * 60 * 24),
+        )
+    except Exception as e:
+        logger.warning(f"Identity cache write failed for {clerk_user_id}: {e}")
+
+
+def invalidate_clerk_identity(clerk_user_id):
+    """Forget a cached identity so the next request re-syncs the user row from its claims."""
+    if not clerk_user_id:
+        return
+    local_identities.delete(clerk_user_id)
+    try:
+        cache.delete(_identity_key(clerk_user_id))
+    except Exception as e:
+        logger.warning(f"Identity cache delete failed for {clerk_user_id}: {e}")
+
+
+async def aget_cached_identity(clerk_user_id):
+    identity = local_identities.get(clerk_user_id)
+    if identity is not None:
+        return identity
+    try:
+        identity = await cache.aget(_identity_key(clerk_user_id))
+    except Exception as e:
+        logger.warning(f"Identity cache read failed for {clerk_user_id}: {e}")
+        return None
+    if identity is not None:
+        local_identities.set(clerk_user_id, identity)
+    return identity
+
+
+async def aset_cached_identity(clerk_user_id, pk, digest):
+    identity = {'pk': pk, 'hash': digest}
+    local_identities.set(clerk_user_id, identity)
+    try:
+        await cache.aset(
+            _identity_key(clerk_user_id),
+            identity,
+            getattr(settings, 'CLERK_IDENTITY_CACHE_TTL', 60 * 60 * 24),
+        )
+    except Exception as e:
+        logger.warning(f"Identity cache write failed for {clerk_user_id}: {e}")
@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import threading
+import time
+
+import jwt
+import requests
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from django.conf import settings
+
+from .lru import LRUCache
+
+logger = logging.getLogger('goldmage')
+
+
+class ClerkTokenError(Exception):
+    """
+    Raised when a Clerk session token fails local verification.
+
+    ``reason`` is a short, stable label used to aggregate failures in logs;
+    ``cache_for`` is how many seconds the rejection may be remembered
+    (0 when the token could become valid later).
+    """
+
+    def __init__(self, message, reason='invalid', cache_for=None):
+        super().__init__(message)
+        self.reason = reason
+        self.cache_for = cache_for
+
+
+class ClerkJWTVerifier:
+    """
+    Verifies Clerk session tokens locally.
+
+    Signing keys are fetched from Clerk's JWKS endpoint once and kept
+    in-process; they are refreshed every ``refresh_interval`` seconds and
+    re-fetched early when a token names a ``kid`` we have not seen (key
+    rotation). Refetches are throttled by ``min_refetch_interval`` so a
+    flood of tokens with bogus ``kid`` values cannot hammer Clerk.
+    ``public_key`` (the instance PEM key) is used when no JWKS URL is
+    configured or the JWKS cannot be reached.
+
+    Rejected tokens are remembered by SHA-256 digest in a bounded negative
+    cache until their own ``exp`` (capped at ``rejection_ttl``), so a client
+    retrying a bad token in a loop costs one hash and a dict lookup. Only
+    rejections that would stand against a freshly fetched JWKS are cached:
+    a signature checked against the fallback PEM key or a stale key set
+    (because Clerk could not be reached) is rejected but not remembered.
+    """
+
+    algorithms = ['RS256']
+
+    def __init__(self, jwks_url=None, secret_key=None, public_key=None,
+                 authorized_parties=None, refresh_interval=3600,
+                 min_refetch_interval=30, leeway=5, timeout=5,
+                 rejection_cache_size=10000, rejection_ttl=3600):
+        self.jwks_url = jwks_url
+        self.secret_key = secret_key
+        self.authorized_parties = list(authorized_parties or [])
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.leeway = leeway
+        self.timeout = timeout
+        self.static_key = None
+        if public_key and public_key.strip():
+            self.static_key = load_pem_public_key(public_key.strip().encode())
+        self.rejection_ttl = rejection_ttl
+        self.rejected = LRUCache(maxsize=rejection_cache_size, ttl=rejection_ttl)
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._last_attempt = None
+        self._lock = threading.Lock()
+
+    def _throttled(self, now):
+        return self._last_attempt is not None and now - self._last_attempt < self.min_refetch_interval
+
+    def needs_refresh(self):
+        if not self.jwks_url:
+            return False
+        now = time.monotonic()
+        if self._throttled(now):
+            return False
+        return not self._keys or now - self._fetched_at > self.refresh_interval
+
+    def needs_fetch_for(self, token):
+        """
+        Whether verifying ``token`` may block on a JWKS request, either
+        because the key set is due for refresh or the token's ``kid`` is
+        unknown and a refetch is allowed.
+        """
+        if not self.jwks_url:
+            return False
+        if self.needs_refresh():
+            return True
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except jwt.InvalidTokenError:
+            return False
+        return kid not in self._keys and not self._throttled(time.monotonic())
+
+    def refresh(self, force=False):
+        """Fetch the JWKS, keeping the previous key set if the fetch fails."""
+        if not self.jwks_url:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._throttled(now):
+                return False
+            self._last_attempt = now
+            try:
+                headers = {}
+                if self.secret_key:
+                    headers['Authorization'] = f'Bearer {self.secret_key}'
+                response = requests.get(self.jwks_url, headers=headers, timeout=self.timeout)
+                response.raise_for_status()
+                jwk_set = jwt.PyJWKSet.from_dict(response.json())
+            except Exception as e:
+                logger.warning(f"Could not refresh Clerk JWKS from {self.jwks_url}: {e}")
+                return False
+            self._keys = {key.key_id: key.key for key in jwk_set.keys}
+            self._fetched_at = now
+            logger.info(f"Loaded {len(self._keys)} Clerk signing key(s)")
+            return True
+
+    def get_signing_key(self, kid):
+        if self.needs_refresh():
+            self.refresh()
+        key = self._keys.get(kid)
+        if key is None and self.jwks_url:
+            # Unknown kid: Clerk may have rotated keys since our last fetch
+            if self.refresh():
+                key = self._keys.get(kid)
+        if key is None:
+            key = self.static_key
+        if key is None:
+            raise ClerkTokenError(
+                f"No signing key found for kid {kid!r}",
+                reason='unknown_kid',
+                cache_for=self.min_refetch_interval if self.jwks_is_fresh() else 0,
+            )
+        return key
+
+    def jwks_is_fresh(self):
+        """Whether the key set came from a JWKS fetch within ``refresh_interval``."""
+        return bool(self._keys) and time.monotonic() - self._fetched_at <= self.refresh_interval
+
+    def is_authoritative(self, key):
+        """
+        Whether a signature check against ``key`` is final: the configured PEM
+        key when there is no JWKS URL, or a key from a fresh JWKS. The PEM key
+        used as a fallback, or a stale key set, may simply predate a rotation.
+        """
+        if not self.jwks_url:
+            return True
+        return key is not self.static_key and self.jwks_is_fresh()
+
+    def verify(self, token):
+        """Verify ``token`` and return its claims, or raise ClerkTokenError."""
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        reason = self.rejected.get(digest)
+        if reason is not None:
+            raise ClerkTokenError("Token was already rejected", reason=reason, cache_for=0)
+        try:
+            return self._verify(token)
+        except ClerkTokenError as e:
+            ttl = self._rejection_ttl(token, e)
+            if ttl > 0:
+                self.rejected.set(digest, e.reason, ttl=ttl)
+            raise
+
+    def _rejection_ttl(self, token, error):
+        if error.cache_for is not None:
+            return min(error.cache_for, self.rejection_ttl)
+        try:
+            exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+            remaining = float(exp) - time.time() + self.leeway
+        except Exception:
+            return self.rejection_ttl
+        # A forged or mis-issued token is useless once it would have expired anyway
+        return max(0, min(remaining, self.rejection_ttl))
+
+    def _verify(self, token):
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise ClerkTokenError(f"Malformed token: {e}", reason='malformed')
+        if header.get('alg') not in self.algorithms:
+            raise ClerkTokenError(f"Unexpected token algorithm: {header.get('alg')}", reason='bad_algorithm')
+
+        key = self.get_signing_key(header.get('kid'))
+        # Rejections that depend on which key we had are only cached against a fresh JWKS
+        key_cache_for = None if self.is_authoritative(key) else 0
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=self.algorithms,
+                leeway=self.leeway,
+                options={
+                    'require': ['exp', 'sub'],
+                    'verify_aud': False,
+                },
+            )
+        except jwt.ExpiredSignatureError:
+            raise ClerkTokenError("Token has expired", reason='expired', cache_for=self.rejection_ttl)
+        except jwt.ImmatureSignatureError:
+            raise ClerkTokenError("Token is not yet valid", reason='not_yet_valid', cache_for=0)
+        except jwt.MissingRequiredClaimError as e:
+            # Claims are checked after the signature, so this holds for any key
+            raise ClerkTokenError(f"Invalid token: {e}", reason='missing_claim')
+        except jwt.InvalidSignatureError:
+            raise ClerkTokenError("Token signature is invalid", reason='bad_signature', cache_for=key_cache_for)
+        except jwt.InvalidTokenError as e:
+            raise ClerkTokenError(f"Invalid token: {e}", cache_for=key_cache_for)
+
+        azp = claims.get('azp')
+        if azp and self.authorized_parties and azp not in self.authorized_parties:
+            raise ClerkTokenError(f"Unauthorized party: {azp}", reason='unauthorized_party')
+        return claims
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """Return the process-wide verifier, building it from settings on first use."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = ClerkJWTVerifier(
+                    jwks_url=getattr(settings, 'CLERK_JWKS_URL', None),
+                    secret_key=settings.CLERK_SECRET_KEY,
+                    public_key=getattr(settings, 'CLERK_JWT_PUBLIC_KEY', None),
+                    authorized_parties=settings.CLERK_AUTH_PARTIES,
+                    refresh_interval=getattr(settings, 'CLERK_JWKS_REFRESH_INTERVAL', 3600),
+                    leeway=getattr(settings, 'CLERK_JWT_LEEWAY', 5),
+                    rejection_cache_size=getattr(settings, 'CLERK_REJECTED_TOKEN_CACHE_SIZE', 10000),
+                    rejection_ttl=getattr(settings, 'CLERK_REJECTED_TOKEN_TTL', 3600),
+                )
+    return _verifier
+
+
+def reset_verifier():
+    """Drop the cached verifier so the next call picks up changed settings."""
+    global _verifier
+    with _verifier_lock:
+        _verifier = None
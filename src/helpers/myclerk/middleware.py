@@ -1,8 +1,12 @@
 import logging
-from helpers.myclerk.utils import (
-    get_clerk_user_id_from_request,
-    update_or_create_clerk_user
-)
+import threading
+from functools import partial
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib.auth.middleware import auser as aget_session_user
+from django.contrib.auth.middleware import get_user as get_session_user
+from django.utils.functional import SimpleLazyObject
+from helpers.myclerk.failures import auth_failures
+from helpers.myclerk.utils import aauthenticate_clerk_request, authenticate_clerk_request
 from django.conf import settings
 
 logger = logging.getLogger('goldmage')
@@ -12,61 +16,131 @@ def django_user_session_via_clerk(request):
     if not settings.CLERK_SECRET_KEY:
         logger.error("CLERK_SECRET_KEY is not set in settings")
         return None
-        
-    # Log all relevant headers
-    logger.info("Request headers:")
-    for header, value in request.headers.items():
-        if header.lower() in ['authorization', 'x-clerk-token', 'cookie', 'origin']:
-            logger.info(f"{header}: {value}")
-    
-    clerk_user_id = get_clerk_user_id_from_request(request)
-    if not clerk_user_id:
-        logger.debug("No Clerk user ID found in request")
-        return None
-    logger.info(f"Found Clerk user ID: {clerk_user_id}")
-    django_user, created = update_or_create_clerk_user(clerk_user_id, request)
-    if created:
-        logger.info(f"Created new Django user for Clerk ID: {clerk_user_id}")
-    elif django_user:
-        logger.info(f"Found existing Django user for Clerk ID: {clerk_user_id}")
+
+    django_user = authenticate_clerk_request(request)
+    if django_user:
+        logger.debug(f"Found Django user for Clerk ID: {django_user.clerk_user_id}")
     else:
-        logger.warning(f"Failed to create/find Django user for Clerk ID: {clerk_user_id}")
+        logger.debug("No Clerk user resolved for request")
     return django_user
 
+class AuthWorkStats:
+    """
+    In-process counters for how often ClerkAuthMiddleware actually had to
+    authenticate. ``skipped`` counts requests that finished without
+    anything touching the Clerk user (preflights, exempt paths, anonymous
+    pages, views that never read ``request.user``).
+    """
+
+    def __init__(self, log_every=1000):
+        self.log_every = log_every
+        self.total = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, authenticated):
+        with self._lock:
+            self.total += 1
+            if not authenticated:
+                self.skipped += 1
+            total, skipped = self.total, self.skipped
+        if total % self.log_every == 0:
+            logger.info(
+                f"Clerk auth stats: {skipped}/{total} requests "
+                f"({skipped / total * 100:.1f}%) skipped authentication"
+            )
+
+    def snapshot(self):
+        with self._lock:
+            return {'total': self.total, 'skipped': self.skipped}
+
+
+auth_stats = AuthWorkStats()
+
+
+def resolve_request_user(request):
+    """Clerk user for the request, falling back to Django's session user."""
+    try:
+        logger.debug(f"Authenticating {request.method} request to: {request.path}")
+        user = django_user_session_via_clerk(request)
+        if user:
+            logger.debug(f"Set user in request: {user.clerk_user_id}")
+            return user
+        logger.debug(f"No user found for request to: {request.path}")
+    except Exception as e:
+        logger.debug("Error in ClerkAuthMiddleware", exc_info=True)
+        auth_failures.record('middleware_error', f"Error in ClerkAuthMiddleware: {str(e)}")
+        # Don't block the request, let it continue without authentication
+    # Don't set request.user to None, let Django handle it
+    return get_session_user(request)
+
+
+async def aresolve_request_user(request):
+    """Async counterpart of resolve_request_user(), backing ``request.auser()``."""
+    try:
+        if settings.CLERK_SECRET_KEY:
+            user = await aauthenticate_clerk_request(request)
+            if user:
+                return user
+        logger.debug(f"No user found for request to: {request.path}")
+    except Exception as e:
+        logger.debug("Error in ClerkAuthMiddleware", exc_info=True)
+        auth_failures.record('middleware_error', f"Error in ClerkAuthMiddleware: {str(e)}")
+    return await aget_session_user(request)
+
+
 class ClerkAuthMiddleware:
+    """
+    Sync and async capable: under ASGI the async path keeps the request on
+    the event loop, and async views can ``await request.auser()`` to
+    authenticate with the async ORM instead of a thread hop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
         # List of paths that don't need authentication
-        self.exempt_paths = [
+        self.exempt_paths = (
             '/webhook/',
             '/webhook/clerk/',
             '/health/',
             '/__reload__/',
             '/static/',
             '/media/',
-        ]
+        )
+
+    def skip_auth(self, request):
+        # Skip authentication for exempt paths and CORS preflights
+        return request.method == 'OPTIONS' or request.path.startswith(self.exempt_paths)
 
     def __call__(self, request):
-        # Skip authentication for exempt paths
-        if any(request.path.startswith(path) for path in self.exempt_paths):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        if self.skip_auth(request):
+            auth_stats.record(authenticated=False)
             return self.get_response(request)
 
-        try:
-            logger.info(f"Processing request to: {request.path}")
-            logger.info(f"Request method: {request.method}")
-            logger.info(f"Request origin: {request.headers.get('origin', 'No origin')}")
-            logger.info(f"Request host: {request.get_host()}")
-            logger.info(f"Request scheme: {request.scheme}")
-            
-            user = django_user_session_via_clerk(request)
-            if user:
-                request.user = user
-                logger.debug(f"Set user in request: {user.clerk_user_id}")
-            else:
-                logger.warning(f"No user found for request to: {request.path}")
-                # Don't set request.user to None, let Django handle it
-        except Exception as e:
-            logger.error(f"Error in ClerkAuthMiddleware: {str(e)}", exc_info=True)
-            # Don't block the request, let it continue without authentication
-            
-        return self.get_response(request)
\ No newline at end of file
+        # Authenticate only when something actually reads request.user;
+        # DRF's ClerkAuthentication shares the same memoized pass.
+        request.user = SimpleLazyObject(lambda: resolve_request_user(request))
+        response = self.get_response(request)
+        auth_stats.record(authenticated=hasattr(request, '_clerk_user'))
+        return response
+
+    async def __acall__(self, request):
+        if self.skip_auth(request):
+            auth_stats.record(authenticated=False)
+            return await self.get_response(request)
+
+        # Sync code (and sync views run in a thread) still reads request.user
+        request.user = SimpleLazyObject(lambda: resolve_request_user(request))
+        request.auser = partial(aresolve_request_user, request)
+        response = await self.get_response(request)
+        auth_stats.record(authenticated=hasattr(request, '_clerk_user'))
+        return response
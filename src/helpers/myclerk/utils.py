@@ -1,100 +1,112 @@
-import json
-from clerk_backend_api import Clerk
-from clerk_backend_api.jwks_helpers import AuthenticateRequestOptions
-
-from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 
-import warnings
 import logging
-import jwt
-
-# Suppress all warnings from a specific package
-warnings.filterwarnings("ignore", module="clerk_backend_api")
-warnings.filterwarnings("ignore", module="pydantic")
 
-CLERK_SECRET_KEY = settings.CLERK_SECRET_KEY
-CLERK_AUTH_PARTIES = settings.CLERK_AUTH_PARTIES
+from .failures import auth_failures
+from .identity import (
+    aget_cached_identity,
+    aset_cached_identity,
+    claims_hash,
+    get_cached_identity,
+    invalidate_clerk_identity,
+    set_cached_identity,
+)
+from .jwks import ClerkTokenError, get_verifier
 
 User = get_user_model()
 logger = logging.getLogger('goldmage')
 
 
-def get_clerk_user_id_from_request(request):
-    sdk = Clerk(bearer_auth=CLERK_SECRET_KEY)
+def get_bearer_token(request):
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header[7:]  # Remove 'Bearer ' prefix
+
+
+def get_clerk_claims_from_request(request):
+    """
+    Verify the request's bearer token locally and return its claims.
+
+    The claims are stored on ``request.clerk_claims`` so later steps reuse
+    them instead of decoding the token again.
+    """
+    if hasattr(request, 'clerk_claims'):
+        return request.clerk_claims
+    request.clerk_claims = None
+
+    token = get_bearer_token(request)
+    if not token:
+        logger.debug("No Bearer token found in Authorization header")
+        return None
+
     try:
-        
-        # Get the token from Authorization header
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            logger.warning("No Bearer token found in Authorization header")
-            return None
-            
-        token = auth_header[7:]  # Remove 'Bearer ' prefix
-        logger.info(f"Received token: {token[:20]}...")
-        
-        # Verify the token
-        request_state = sdk.authenticate_request(
-            request,
-            AuthenticateRequestOptions(
-                authorized_parties=CLERK_AUTH_PARTIES
-            )
-        )
-        
-        if not request_state.is_signed_in:
-            logger.warning("User is not signed in according to Clerk")
-            return None
-            
-        # Extract user ID from the token
-        # The token is a JWT and we can see from the logs that it contains 'sub' claim
-        # which is the user ID
-        try:
-            # The token is already verified by authenticate_request
-            # We can safely decode it to get the user ID
-            decoded = jwt.decode(token, options={"verify_signature": False})
-            clerk_user_id = decoded.get('sub')
-            
-            if clerk_user_id:
-                logger.debug(f"Successfully extracted Clerk user ID: {clerk_user_id}")
-                return clerk_user_id
-            else:
-                logger.warning("No 'sub' claim found in token")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error decoding JWT token: {str(e)}", exc_info=True)
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error authenticating request with Clerk: {str(e)}", exc_info=True)
+        claims = get_verifier().verify(token)
+    except ClerkTokenError as e:
+        auth_failures.record(e.reason, f"{e} ({request.method} {request.path})")
         return None
 
+    request.clerk_claims = claims
+    return claims
+
+
+def get_clerk_user_id_from_request(request):
+    claims = get_clerk_claims_from_request(request)
+    if not claims:
+        return None
+    clerk_user_id = claims.get('sub')
+    if clerk_user_id:
+        logger.debug(f"Successfully extracted Clerk user ID: {clerk_user_id}")
+    else:
+        logger.warning("No 'sub' claim found in token")
+    return clerk_user_id
+
+
+def user_data_from_claims(clerk_user_id, claims):
+    """Profile fields copied from the session token onto the CustomUser row."""
+    return {
+        "username": claims.get('username') or f"user_{clerk_user_id[-8:]}",
+        "first_name": claims.get('first_name') or "",
+        "last_name": claims.get('last_name') or "",
+        "email": claims.get('email') or "",
+    }
+
 
-def update_or_create_clerk_user(clerk_user_id, request):
+def track_clerk_signup(user_obj, request):
+    from helpers._mixpanel.client import mixpanel_client
+    mixpanel_client.track_user_signup(
+        user_obj.clerk_user_id,
+        {
+            "user_email": user_obj.email,
+            "ip_address": request.META.get("REMOTE_ADDR"),
+            "user_agent": request.META.get("HTTP_USER_AGENT"),
+        }
+    )
+
+
+def update_or_create_clerk_user(clerk_user_id, request, claims=None):
     if not clerk_user_id:
         logger.warning("No clerk_user_id provided")
         return None, None
         
     try:
-        # Get the token from the request
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            logger.warning("No Bearer token found in Authorization header")
+        decoded = claims if claims is not None else get_clerk_claims_from_request(request)
+        if not decoded:
+            logger.warning("No verified Clerk claims available for request")
             return None, None
-            
-        token = auth_header[7:]  # Remove 'Bearer ' prefix
-        
-        # Decode the JWT token
-        decoded = jwt.decode(token, options={"verify_signature": False})
-        
-        # Get user data from the token
-        user_data = {
-            "username": decoded.get('username') or f"user_{clerk_user_id[-8:]}",
-            "first_name": decoded.get('first_name') or "",
-            "last_name": decoded.get('last_name') or "",
-            "email": decoded.get('email') or "",
-        }
-        
+
+        user_data = user_data_from_claims(clerk_user_id, decoded)
+        digest = claims_hash(user_data)
+
+        # Profile claims unchanged since the last sync: just load the row
+        identity = get_cached_identity(clerk_user_id)
+        if identity and identity['hash'] == digest:
+            try:
+                return User.objects.get(pk=identity['pk'], clerk_user_id=clerk_user_id), False
+            except User.DoesNotExist:
+                invalidate_clerk_identity(clerk_user_id)
+
         logger.info(f"Attempting to create/update user with data: {user_data}")
         
         try:
@@ -102,27 +114,103 @@ def update_or_create_clerk_user(clerk_user_id, request):
                 clerk_user_id=clerk_user_id,
                 defaults=user_data
             )
+            set_cached_identity(clerk_user_id, user_obj.pk, digest)
             
             if created:
                 logger.info(f"Created new user with ID: {user_obj.id}")
-                from helpers._mixpanel.client import mixpanel_client
-                mixpanel_client.track_user_signup(
-                    clerk_user_id,
-                    {
-                        "user_email": user_obj.email,
-                        "ip_address": request.META.get("REMOTE_ADDR"),
-                        "user_agent": request.META.get("HTTP_USER_AGENT"),
-                    }
-                )
+                track_clerk_signup(user_obj, request)
             else:
                 logger.info(f"Updated existing user with ID: {user_obj.id}")
                 
             return user_obj, created
             
         except Exception as e:
-            logger.error(f"Database error while creating/updating user: {str(e)}", exc_info=True)
+            logger.debug("Database error while creating/updating user", exc_info=True)
+            auth_failures.record('user_sync_error', f"Database error while creating/updating user: {str(e)}")
             return None, None
             
     except Exception as e:
-        logger.error(f"Error processing user data: {str(e)}", exc_info=True)
-        return None, None
\ No newline at end of file
+        logger.debug("Error processing user data", exc_info=True)
+        auth_failures.record('user_data_error', f"Error processing user data: {str(e)}")
+        return None, None
+
+
+def authenticate_clerk_request(request):
+    """
+    Resolve the Clerk user for a Django ``HttpRequest`` exactly once.
+
+    The token is verified and the user loaded on the first call; the
+    result (a user or None) is memoized on the request so the middleware
+    and the DRF authentication class share a single pass.
+    """
+    if hasattr(request, '_clerk_user'):
+        return request._clerk_user
+
+    user = None
+    claims = get_clerk_claims_from_request(request)
+    clerk_user_id = claims.get('sub') if claims else None
+    if clerk_user_id:
+        user, created = update_or_create_clerk_user(clerk_user_id, request, claims=claims)
+        if created:
+            logger.info(f"Created new Django user for Clerk ID: {clerk_user_id}")
+    request._clerk_user = user
+    return user
+
+
+async def aget_clerk_claims_from_request(request):
+    """
+    Async counterpart of get_clerk_claims_from_request().
+
+    Verification itself is pure CPU and runs inline; only when the verifier
+    has to fetch signing keys from Clerk is it pushed to a worker thread.
+    """
+    if hasattr(request, 'clerk_claims'):
+        return request.clerk_claims
+
+    token = get_bearer_token(request)
+    verifier = get_verifier()
+    if token and verifier.needs_fetch_for(token):
+        return await sync_to_async(get_clerk_claims_from_request)(request)
+    return get_clerk_claims_from_request(request)
+
+
+async def aupdate_or_create_clerk_user(clerk_user_id, request, claims):
+    """Async counterpart of update_or_create_clerk_user(), using the async ORM."""
+    try:
+        user_data = user_data_from_claims(clerk_user_id, claims)
+        digest = claims_hash(user_data)
+
+        identity = await aget_cached_identity(clerk_user_id)
+        if identity and identity['hash'] == digest:
+            try:
+                return await User.objects.aget(pk=identity['pk'], clerk_user_id=clerk_user_id), False
+            except User.DoesNotExist:
+                await sync_to_async(invalidate_clerk_identity)(clerk_user_id)
+
+        user_obj, created = await User.objects.aupdate_or_create(
+            clerk_user_id=clerk_user_id,
+            defaults=user_data
+        )
+        await aset_cached_identity(clerk_user_id, user_obj.pk, digest)
+        if created:
+            logger.info(f"Created new user with ID: {user_obj.id}")
+            await sync_to_async(track_clerk_signup)(user_obj, request)
+        return user_obj, created
+    except Exception as e:
+        logger.debug("Database error while creating/updating user", exc_info=True)
+        auth_failures.record('user_sync_error', f"Database error while creating/updating user: {str(e)}")
+        return None, None
+
+
+async def aauthenticate_clerk_request(request):
+    """Async counterpart of authenticate_clerk_request(); shares the same memo."""
+    if hasattr(request, '_clerk_user'):
+        return request._clerk_user
+
+    user = None
+    claims = await aget_clerk_claims_from_request(request)
+    clerk_user_id = claims.get('sub') if claims else None
+    if clerk_user_id:
+        user, created = await aupdate_or_create_clerk_user(clerk_user_id, request, claims)
+    request._clerk_user = user
+    return user